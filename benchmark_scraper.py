@@ -0,0 +1,135 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+# --- Benchmark แบบ offline: เสิร์ฟ hydro4d.html (fixture) บนเครื่อง + Sheets service ปลอม แล้วรายงาน p50/p95 ต่อขั้นตอน ---
+# ตัวอย่าง: python benchmark_scraper.py --stations 50 --iterations 10 --budget http_data=0.5 --budget sheets_write=0.2
+import selenium_table_scraper as scraper
+
+
+# --- สร้าง fixture: หน้า jqGrid แบบ static (ใช้ได้ทั้ง Selenium) + ไฟล์ข้อมูล JSON ของ grid (ใช้กับ HTTP fast path) ---
+def build_fixture(fixture_dir, num_stations):
+    row_ids = [str(1000 + i) for i in range(num_stations)]; grid_rows = []; html_rows = []
+    for n, rid in enumerate(row_ids, 1):
+        cells = [str(n), f"สถานี {rid}", "ลุ่มน้ำทดสอบ", "อำเภอทดสอบ", "จังหวัดทดสอบ", f"{10 + n % 7}.50 {200 + n}"]
+        cells += [f"{1 + (n + d) % 9}.{d}0 {100 + n + d}.5" for d in range(7)]
+        cells += [f"{3 + n % 5}.25 {150 + n}.0", "กราฟ", f"{40 + n % 50}", "คงที่"]
+        grid_rows.append({'id': rid, 'cell': cells})
+        html_rows.append(f'<tr id="{rid}" class="jqgrow"><td style="display:none">{rid}</td>' + ''.join(f'<td>{c}</td>' for c in cells) + '</tr>')
+    page = ('<html><head><meta charset="utf-8"><title>hydro4d fixture</title></head><body>'
+            '<div id="gbox_jqGrid"><table id="jqGrid">' + ''.join(html_rows) + '</table></div>'
+            '<script>if (window.jQuery) { $("#jqGrid").jqGrid({ url: "grid_data.json", datatype: "json" }); }</script></body></html>')
+    with open(os.path.join(fixture_dir, 'hydro4d.html'), 'w', encoding='utf-8') as f: f.write(page)
+    with open(os.path.join(fixture_dir, 'grid_data.json'), 'w', encoding='utf-8') as f: json.dump({'rows': grid_rows}, f, ensure_ascii=False)
+    return row_ids
+
+
+# --- HTTP server บนเครื่อง (thread แยก) พร้อมหน่วงเวลาจำลอง network ---
+class FixtureHandler(SimpleHTTPRequestHandler):
+    latency_seconds = 0.0
+    def do_GET(self):
+        if self.latency_seconds: time.sleep(self.latency_seconds)
+        super().do_GET()
+    def log_message(self, format, *args): pass
+
+def start_fixture_server(fixture_dir, latency_ms=0):
+    handler = type('Handler', (FixtureHandler,), {'latency_seconds': latency_ms / 1000.0})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(handler, directory=fixture_dir))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/hydro4d.html"
+
+
+# --- Google Sheets service ปลอม: รองรับ call ที่ SheetsWriter ใช้ และหน่วงเวลาแทน round trip จริง ---
+class FakeRequest:
+    def __init__(self, result, latency_seconds): self.result = result; self.latency_seconds = latency_seconds
+    def execute(self):
+        if self.latency_seconds: time.sleep(self.latency_seconds)
+        return self.result
+
+class FakeSheetsService:
+    def __init__(self, latency_ms=0):
+        self.latency_seconds = latency_ms / 1000.0; self.calls = []; self.log_rows = 0
+    def spreadsheets(self): return self
+    def values(self): return self
+    def _request(self, name, result): self.calls.append(name); return FakeRequest(result, self.latency_seconds)
+    def get(self, spreadsheetId=None, range=None, **kwargs):
+        if range: return self._request('values.get', {'values': []})
+        sheets = [{'properties': {'sheetId': i, 'title': title}} for i, title in enumerate([scraper.SHEET_NAME_LATEST, scraper.SHEET_NAME_LOG])]
+        return self._request('get', {'sheets': sheets})
+    def batchUpdate(self, spreadsheetId=None, body=None):
+        for request in body.get('requests', []): self.log_rows += len(request.get('appendCells', {}).get('rows', []))
+        return self._request('batchUpdate', {'replies': [{} for _ in body.get('requests', [])]})
+
+
+# --- รัน run_once() ซ้ำ N รอบ ด้วย store/cache/state ใหม่ทุกรอบ (เหมือน cron container), คืนจำนวนรอบที่ดึงข้อมูลไม่ครบทุกสถานี ---
+def run_benchmark(page_url, row_ids, iterations, fetch_mode, sheets_latency_ms):
+    scraper.TARGET_URL = page_url; scraper.GRID_DATA_URL = None; scraper.FETCH_MODE = fetch_mode; scraper.CACHE_TTL_SECONDS = 0
+    scraper.TARGET_ROW_IDS = list(row_ids); scraper.STATION_PAGES = {rid: page_url for rid in row_ids}; failed_iterations = 0
+    for i in range(iterations):
+        work_dir = tempfile.mkdtemp(prefix='bench_'); service = FakeSheetsService(sheets_latency_ms)
+        try:
+            writer = scraper.SheetsWriter(service, state_path=os.path.join(work_dir, 'sheets_state.json'))
+            store = scraper.ReadingStore(os.path.join(work_dir, 'readings.sqlite3')); cache = scraper.ResponseCache(os.path.join(work_dir, 'response_cache.json'))
+            try:
+                with scraper.metrics.span('run', iteration=i): results = scraper.run_once(service, writer=writer, store=store, cache=cache)
+                ok = sum(1 for block in results.values() if block)
+            finally: store.close()
+            logging.info(f"รอบ {i + 1}/{iterations}: สำเร็จ {ok}/{len(row_ids)} สถานี, Sheets {len(service.calls)} call, Log {service.log_rows} แถว")
+            if ok < len(row_ids): failed_iterations += 1; logging.error(f"รอบ {i + 1}: ดึงข้อมูลไม่ครบ ขาด {len(row_ids) - ok} สถานี")
+        finally: shutil.rmtree(work_dir, ignore_errors=True)
+    return failed_iterations
+
+
+def check_budgets(summary, budgets):
+    failures = []
+    for budget in budgets:
+        stage, limit = budget.split('=', 1); st = summary.get(stage.strip())
+        if st is None: failures.append(f"{stage}: ไม่มีข้อมูลของขั้นตอนนี้"); continue
+        if st['p95'] > float(limit): failures.append(f"{stage}: p95 {st['p95']:.3f} วิ เกิน {float(limit):.3f} วิ")
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark การดึงข้อมูล/เขียนชีตแบบ offline (ไม่ใช้เว็บจริงและ Google)")
+    parser.add_argument('--stations', type=int, default=20, help="จำนวนสถานีใน fixture")
+    parser.add_argument('--iterations', type=int, default=5, help="จำนวนรอบที่รัน")
+    parser.add_argument('--mode', choices=['http', 'selenium', 'auto'], default='http', help="FETCH_MODE ที่ใช้ทดสอบ (selenium ต้องมี Chrome)")
+    parser.add_argument('--fixture-dir', help="โฟลเดอร์ที่มี hydro4d.html ที่บันทึกไว้ (ถ้าไม่ระบุจะสร้าง fixture ให้)")
+    parser.add_argument('--row-ids', help="Row ID ที่ใช้กับ --fixture-dir คั่นด้วย ,")
+    parser.add_argument('--latency-ms', type=int, default=0, help="หน่วงเวลาแต่ละ request ของ fixture server")
+    parser.add_argument('--sheets-latency-ms', type=int, default=0, help="หน่วงเวลาแต่ละ call ของ Sheets ปลอม")
+    parser.add_argument('--metrics-jsonl', help="เขียน span ทั้งหมดเป็น JSON lines")
+    parser.add_argument('--metrics-prom', help="เขียนสรุปเป็น Prometheus text file")
+    parser.add_argument('--output', help="เขียนสรุป p50/p95 ต่อขั้นตอนเป็น JSON")
+    parser.add_argument('--budget', action='append', default=[], help="STAGE=SECONDS: exit 1 ถ้า p95 ของขั้นตอนเกินค่านี้ (ใช้ใน CI)")
+    args = parser.parse_args()
+
+    scraper.setup_logging(); scraper.apply_config({'SPREADSHEET_ID': 'benchmark', 'SHEET_NAME_LATEST': 'ExtractedData', 'SHEET_NAME_LOG': 'Log', 'FETCH_MODE': args.mode}) # ไม่อ่าน config.txt จริง
+    scraper.metrics = scraper.StageMetrics(jsonl_path=args.metrics_jsonl)
+    own_fixture = not args.fixture_dir; fixture_dir = args.fixture_dir or tempfile.mkdtemp(prefix='hydro4d_fixture_')
+    row_ids = build_fixture(fixture_dir, args.stations) if own_fixture else [r.strip() for r in (args.row_ids or scraper.TARGET_ROW_ID).split(',') if r.strip()]
+    server, page_url = start_fixture_server(fixture_dir, args.latency_ms)
+    logging.info(f"--- Benchmark: {len(row_ids)} สถานี x {args.iterations} รอบ, mode={args.mode}, fixture={page_url} ---")
+    try: failed_iterations = run_benchmark(page_url, row_ids, args.iterations, args.mode, args.sheets_latency_ms)
+    finally:
+        server.shutdown()
+        if own_fixture: shutil.rmtree(fixture_dir, ignore_errors=True)
+
+    summary = scraper.metrics.summary()
+    print(f"{'stage':<22}{'count':>7}{'p50 (s)':>11}{'p95 (s)':>11}{'max (s)':>11}")
+    for stage, st in sorted(summary.items(), key=lambda kv: -kv[1]['total']): print(f"{stage:<22}{st['count']:>7}{st['p50']:>11.4f}{st['p95']:>11.4f}{st['max']:>11.4f}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f: json.dump({'stations': len(row_ids), 'iterations': args.iterations, 'mode': args.mode, 'stages': summary}, f, ensure_ascii=False, indent=2)
+    if args.metrics_prom: scraper.metrics.write_prometheus(args.metrics_prom)
+    failures = check_budgets(summary, args.budget)
+    for failure in failures: logging.error(f"เกินงบเวลา: {failure}")
+    if failed_iterations: logging.error(f"ดึงข้อมูลไม่ครบทุกสถานี {failed_iterations}/{args.iterations} รอบ (parser/fetch path เสีย?)")
+    sys.exit(1 if failures or failed_iterations else 0)
@@ -1,55 +1,168 @@
 import os
 import os.path
+import sys
 import time
 import json
+import math
+import re
+import sqlite3
+import hashlib
+import signal
+import subprocess
+import threading
+import multiprocessing
+from multiprocessing.connection import wait as wait_connections
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 import logging
+import html as html_lib
+import xml.etree.ElementTree as ET
+from urllib.parse import urljoin
 from datetime import datetime, timedelta
 
-# --- Selenium Imports ---
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service as ChromeService
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, NoSuchElementException, WebDriverException
-try: from webdriver_manager.chrome import ChromeDriverManager; USE_WEBDRIVER_MANAGER = True
-except ImportError: USE_WEBDRIVER_MANAGER = False
-
-# --- Google API Imports ---
-try:
+# --- Selenium / Google API / requests โหลดเมื่อขั้นตอนที่ใช้ถูกเรียกเท่านั้น (import โมดูลนี้เป็น library ได้เร็ว) ---
+webdriver = ChromeService = By = WebDriverWait = EC = ChromeDriverManager = None; USE_WEBDRIVER_MANAGER = None
+Request = Credentials = InstalledAppFlow = build = requests = HTTPAdapter = None; USE_REQUESTS = None
+class _SeleniumNotLoaded(Exception): pass
+class _GoogleNotLoaded(Exception): pass
+TimeoutException = NoSuchElementException = WebDriverException = _SeleniumNotLoaded; HttpError = _GoogleNotLoaded
+
+def load_selenium():
+    global webdriver, ChromeService, By, WebDriverWait, EC, TimeoutException, NoSuchElementException, WebDriverException, ChromeDriverManager, USE_WEBDRIVER_MANAGER
+    if webdriver is not None: return
+    from selenium import webdriver as _webdriver
+    from selenium.webdriver.chrome.service import Service as ChromeService
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.common.exceptions import TimeoutException, NoSuchElementException, WebDriverException
+    try: from webdriver_manager.chrome import ChromeDriverManager; USE_WEBDRIVER_MANAGER = True
+    except ImportError: USE_WEBDRIVER_MANAGER = False
+    webdriver = _webdriver
+
+def load_google():
+    global Request, Credentials, InstalledAppFlow, build, HttpError
+    if build is not None: return
     from google.auth.transport.requests import Request; from google.oauth2.credentials import Credentials
-    from google_auth_oauthlib.flow import InstalledAppFlow; from googleapiclient.discovery import build
-    from googleapiclient.errors import HttpError
-except ImportError: exit(1)
+    from google_auth_oauthlib.flow import InstalledAppFlow; from googleapiclient.errors import HttpError
+    from googleapiclient.discovery import build
+
+def load_requests():
+    global requests, HTTPAdapter, USE_REQUESTS
+    if USE_REQUESTS is not None: return USE_REQUESTS
+    try: import requests; from requests.adapters import HTTPAdapter; USE_REQUESTS = True
+    except ImportError: USE_REQUESTS = False
+    return USE_REQUESTS
 
-# --- Logging Setup ---
-logging.basicConfig(level=logging.INFO, format='%(asctime)s-%(levelname)s-%(message)s', handlers=[logging.StreamHandler()])
+# --- Logging Setup (เรียกจาก CLI; ตอนใช้เป็น library ให้โปรแกรมที่เรียกตั้งค่า logging เอง) ---
+def setup_logging(level=logging.INFO):
+    logging.basicConfig(level=level, format='%(asctime)s-%(levelname)s-%(message)s', handlers=[logging.StreamHandler()])
 
 # --- ค่าคงที่และ การตั้งค่า ---
 try: script_dir = os.path.dirname(os.path.abspath(__file__))
 except NameError: script_dir = os.getcwd()
-CONFIG_FILE = 'config.txt'; config_values = {}; SPREADSHEET_ID = None; SHEET_NAME_LATEST = None; SHEET_NAME_LOG = None
-try:
-    logging.info(f"--- อ่าน Config '{CONFIG_FILE}' ---")
-    config_path = os.path.join(script_dir, CONFIG_FILE)
-    if not os.path.exists(config_path): raise FileNotFoundError(f"ไม่พบ '{CONFIG_FILE}'...")
+CONFIG_FILE = 'config.txt'
+TARGET_URL = 'https://hyd-app.rid.go.th/hydro4d.html'; TARGET_ROW_ID = "235"
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets']; CREDENTIALS_FILE = 'credentials.json'; TOKEN_FILE = 'token.json'; SHEETS_STATE_FILE = 'sheets_state.json'
+RESPONSE_CACHE_FILE = 'response_cache.json'
+CHROMEDRIVER_FALLBACK_PATH = os.path.join(script_dir, 'chromedriver.exe'); WAIT_TIME_SECONDS = 60
+PAGE_LOAD_TIMEOUT_SECONDS = 180 # <<< เพิ่มเวลารอโหลดหน้าเว็บเป็น 3 นาที
+HTTP_TIMEOUT_SECONDS = 30
+
+
+# --- ตั้งค่าตัวแปรระดับโมดูลจาก dict ของ config (ค่าที่ไม่ระบุใช้ค่าเริ่มต้น) ---
+def apply_config(values):
+    global config_values, SPREADSHEET_ID, SHEET_NAME_LATEST, SHEET_NAME_LOG, STATION_SPECS, TARGET_ROW_IDS, STATION_PAGES, CACHE_TTL_SECONDS, READINGS_DB_FILE
+    global MAX_WORKERS, JOB_TIMEOUT_SECONDS, WORKER_MEMORY_MB, FETCH_MODE, GRID_DATA_URL, WATCH_INTERVAL_SECONDS, DRIVER_POOL_SIZE, DRIVER_MAX_USES, METRICS_JSONL, METRICS_PROM
+    config_values = dict(values)
+    SPREADSHEET_ID = config_values.get('SPREADSHEET_ID'); SHEET_NAME_LATEST = config_values.get('SHEET_NAME_LATEST'); SHEET_NAME_LOG = config_values.get('SHEET_NAME_LOG')
+    # --- รายการสถานี (Row ID) จาก config: TARGET_ROW_IDS = 235,236,... (ถ้าไม่ระบุใช้ TARGET_ROW_ID) ---
+    # --- สถานีที่อยู่คนละหน้า/ตัวกรอง ระบุเป็น RowID@URL เช่น 1001@https://hyd-app.rid.go.th/hydro1d.html ---
+    STATION_SPECS = [r.strip() for r in config_values.get('TARGET_ROW_IDS', TARGET_ROW_ID).split(',') if r.strip()] or [TARGET_ROW_ID]
+    TARGET_ROW_IDS = [spec.split('@', 1)[0].strip() for spec in STATION_SPECS]
+    STATION_PAGES = {spec.split('@', 1)[0].strip(): (spec.split('@', 1)[1].strip() if '@' in spec else TARGET_URL) for spec in STATION_SPECS}
+    CACHE_TTL_SECONDS = int(config_values.get('CACHE_TTL_SECONDS', 0)) # 0 = ดึงใหม่ทุกรอบ, >0 = ข้ามสถานีที่ตรวจสอบไปแล้วภายใน TTL
+    READINGS_DB_FILE = config_values.get('READINGS_DB', 'water_readings.sqlite3') # ฐานข้อมูล SQLite เก็บค่าระดับน้ำ/ปริมาณน้ำรายวันของแต่ละสถานี
+    # --- ดึงข้อมูลพร้อมกันหลายหน้า: 1 job ต่อ 1 URL, 1 process (Chrome ของตัวเอง) ต่อ job, จำกัดตาม CPU/RAM ---
+    MAX_WORKERS = int(config_values.get('MAX_WORKERS', 4)); JOB_TIMEOUT_SECONDS = int(config_values.get('JOB_TIMEOUT_SECONDS', PAGE_LOAD_TIMEOUT_SECONDS)); WORKER_MEMORY_MB = int(config_values.get('WORKER_MEMORY_MB', 400))
+    # --- HTTP fast path: FETCH_MODE = auto (HTTP ก่อน แล้ว Selenium สำรอง) / http / selenium ---
+    FETCH_MODE = config_values.get('FETCH_MODE', 'auto').lower(); GRID_DATA_URL = config_values.get('GRID_DATA_URL') # ถ้าไม่ระบุ จะหา url ของ jqGrid จากหน้าเว็บ
+    # --- โหมด --watch: รันซ้ำทุก WATCH_INTERVAL_SECONDS โดยใช้ Chrome ที่เปิดค้างไว้ (ปิด/เปิดใหม่ทุก DRIVER_MAX_USES รอบ) ---
+    WATCH_INTERVAL_SECONDS = int(config_values.get('WATCH_INTERVAL_SECONDS', 1800)); DRIVER_POOL_SIZE = int(config_values.get('DRIVER_POOL_SIZE', 1)); DRIVER_MAX_USES = int(config_values.get('DRIVER_MAX_USES', 20))
+    # --- Metrics เวลาของแต่ละขั้นตอน: JSON lines (METRICS_JSONL) และ/หรือ Prometheus text file (METRICS_PROM) ---
+    METRICS_JSONL = config_values.get('METRICS_JSONL'); METRICS_PROM = config_values.get('METRICS_PROM')
+    metrics.jsonl_path = METRICS_JSONL
+
+
+# --- อ่าน config.txt (KEY = VALUE) แล้วตั้งค่าโมดูล; require_sheets=False สำหรับ --dry-run ที่ไม่ใช้ Google ---
+def load_config(path=None, require_sheets=True):
+    config_path = path or os.path.join(script_dir, CONFIG_FILE); values = {}
+    logging.info(f"--- อ่าน Config '{config_path}' ---")
+    if not os.path.exists(config_path): raise FileNotFoundError(f"ไม่พบ '{config_path}'...")
     with open(config_path, 'r', encoding='utf-8') as f:
         for line_num, line in enumerate(f, 1):
             line = line.strip();
-            if line and not line.startswith('#') and '=' in line: key, value = line.split('=', 1); config_values[key.strip()] = value.strip(); logging.info(f"  อ่าน {line_num}: {key.strip()}='{value.strip()}'")
-    SPREADSHEET_ID = config_values.get('SPREADSHEET_ID'); SHEET_NAME_LATEST = config_values.get('SHEET_NAME_LATEST'); SHEET_NAME_LOG = config_values.get('SHEET_NAME_LOG')
-    if not SPREADSHEET_ID or not SHEET_NAME_LATEST or not SHEET_NAME_LOG: raise ValueError(f"ไม่พบ SPREADSHEET_ID/LATEST/LOG")
+            if line and not line.startswith('#') and '=' in line: key, value = line.split('=', 1); values[key.strip()] = value.strip(); logging.info(f"  อ่าน {line_num}: {key.strip()}='{value.strip()}'")
+    if require_sheets and (not values.get('SPREADSHEET_ID') or not values.get('SHEET_NAME_LATEST') or not values.get('SHEET_NAME_LOG')): raise ValueError(f"ไม่พบ SPREADSHEET_ID/LATEST/LOG")
+    apply_config(values)
     logging.info(f"อ่าน Config สำเร็จ: ID='{SPREADSHEET_ID}', Latest='{SHEET_NAME_LATEST}', Log='{SHEET_NAME_LOG}'")
-except Exception as e: logging.error(f"Error อ่าน config: {e}"); exit(1)
+    return values
 
-TARGET_URL = 'https://hyd-app.rid.go.th/hydro4d.html'; TARGET_ROW_ID = "235"
-SCOPES = ['https://www.googleapis.com/auth/spreadsheets']; CREDENTIALS_FILE = 'credentials.json'; TOKEN_FILE = 'token.json'
-CHROMEDRIVER_FALLBACK_PATH = os.path.join(script_dir, 'chromedriver.exe'); WAIT_TIME_SECONDS = 60
-PAGE_LOAD_TIMEOUT_SECONDS = 180 # <<< เพิ่มเวลารอโหลดหน้าเว็บเป็น 3 นาที
 
-# --- ฟังก์ชันยืนยันตัวตน Google (ถูกต้องแล้ว) ---
+# --- เก็บเวลาแต่ละขั้นตอน (span) เช่น chromedriver_install, page_load, grid_wait, dom_read, http_data, sheets_write ---
+class StageMetrics:
+    def __init__(self, jsonl_path=None):
+        self.jsonl_path = jsonl_path; self.spans = []
+
+    @contextmanager
+    def span(self, stage, **labels):
+        start = time.perf_counter(); status = 'ok'
+        try: yield
+        except BaseException: status = 'error'; raise
+        finally: self.record(stage, time.perf_counter() - start, status=status, **labels)
+
+    def record(self, stage, seconds, status='ok', **labels):
+        entry = {'ts': datetime.now().isoformat(timespec='milliseconds'), 'stage': stage, 'seconds': round(seconds, 6), 'status': status, 'pid': os.getpid(), **labels}
+        self.spans.append(entry)
+        if self.jsonl_path:
+            try:
+                with open(self.jsonl_path, 'a', encoding='utf-8') as f: f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            except Exception as e: logging.warning(f"เขียน metrics '{self.jsonl_path}' ไม่ได้: {e}")
+
+    @staticmethod
+    def percentile(values, q):
+        ordered = sorted(values)
+        return ordered[max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))] if ordered else 0.0 # nearest-rank
+
+    def summary(self):
+        by_stage = {}
+        for entry in self.spans: by_stage.setdefault(entry['stage'], []).append(entry['seconds'])
+        return {stage: {'count': len(v), 'total': sum(v), 'p50': self.percentile(v, 50), 'p95': self.percentile(v, 95), 'max': max(v)} for stage, v in by_stage.items()}
+
+    def log_summary(self):
+        for stage, st in sorted(self.summary().items(), key=lambda kv: -kv[1]['total']):
+            logging.info(f"  [metrics] {stage}: {st['count']} ครั้ง, รวม {st['total']:.3f} วิ, p50 {st['p50']:.3f}, p95 {st['p95']:.3f}")
+
+    def write_prometheus(self, path):
+        lines = ['# HELP water_scraper_stage_seconds Time spent per scrape/write stage.', '# TYPE water_scraper_stage_seconds summary']
+        for stage, st in sorted(self.summary().items()):
+            lines += [f'water_scraper_stage_seconds{{stage="{stage}",quantile="0.5"}} {st["p50"]:.6f}', f'water_scraper_stage_seconds{{stage="{stage}",quantile="0.95"}} {st["p95"]:.6f}',
+                      f'water_scraper_stage_seconds_sum{{stage="{stage}"}} {st["total"]:.6f}', f'water_scraper_stage_seconds_count{{stage="{stage}"}} {st["count"]}']
+        try:
+            with open(path + '.tmp', 'w', encoding='utf-8') as f: f.write('\n'.join(lines) + '\n')
+            os.replace(path + '.tmp', path) # เขียนไฟล์ใหม่ทั้งไฟล์ ให้ node_exporter textfile collector อ่านได้ไม่ขาดกลาง
+        except Exception as e: logging.warning(f"เขียน Prometheus metrics '{path}' ไม่ได้: {e}")
+
+metrics = StageMetrics()
+apply_config({}) # ค่าเริ่มต้น (ยังไม่อ่านไฟล์) จนกว่าจะเรียก load_config()
+
+# --- ฟังก์ชันยืนยันตัวตน Google: สร้าง Service ครั้งเดียวต่อ process แล้วใช้ซ้ำ ---
+_sheets_service = None
 def authenticate_google_sheets():
-    # ... (โค้ดส่วนนี้เหมือนเดิมเป๊ะ) ...
+    global _sheets_service
+    if _sheets_service is not None: return _sheets_service
+    try: load_google()
+    except ImportError as e_import: logging.error(f"ไม่พบไลบรารี Google API: {e_import}"); return None
     logging.info("--- ยืนยันตัวตน Google Sheets API ---"); creds = None
     token_path = os.path.join(script_dir, TOKEN_FILE); credentials_path = os.path.join(script_dir, CREDENTIALS_FILE)
     if not os.path.exists(credentials_path): logging.error(f"ไม่พบ '{CREDENTIALS_FILE}'..."); return None
@@ -70,14 +183,16 @@ def authenticate_google_sheets():
                 logging.info(f"บันทึก Token ใหม่ลง '{TOKEN_FILE}'")
             except Exception as e: logging.error(f"บันทึก Token ไม่ได้: {e}")
     if not creds: logging.error("ไม่สามารถรับ Credentials"); return None
-    try: service = build('sheets', 'v4', credentials=creds); logging.info("เชื่อมต่อ Sheets API Service สำเร็จ!"); return service
+    try:
+        # static_discovery: ใช้ discovery document ที่มากับ googleapiclient (ไม่ fetch จาก network)
+        with metrics.span('sheets_build'): service = build('sheets', 'v4', credentials=creds, static_discovery=True, cache_discovery=False)
+        logging.info("เชื่อมต่อ Sheets API Service สำเร็จ!"); _sheets_service = service; return service
     except Exception as e: logging.error(f"สร้าง Service Sheets ผิดพลาด: {e}"); return None
 
 
-# --- ฟังก์ชันดึงข้อมูลและจัดรูปแบบ (เพิ่ม Timeout และ Options) ---
-def scrape_format_like_web():
-    logging.info(f"--- เริ่มต้นดึงข้อมูล Selenium (Row ID: {TARGET_ROW_ID}) ---");
-    options = webdriver.ChromeOptions()
+# --- ฟังก์ชันสร้าง ChromeOptions และเปิด Browser ---
+def build_chrome_options():
+    load_selenium(); options = webdriver.ChromeOptions()
     options.add_argument('--headless')
     options.add_argument('--disable-gpu')
     options.add_argument('--window-size=1920x1080')
@@ -89,86 +204,626 @@ def scrape_format_like_web():
     options.add_argument('--disable-extensions')
     options.add_argument("--disable-infobars")
     # -----------------------------------------
+    return options
 
-    driver = None; service = None
-    try: # เปิด Browser
+# --- หา Path ChromeDriver ครั้งเดียวต่อ process (webdriver-manager อาจเรียก network/filesystem) ---
+_chromedriver_path = None
+def resolve_chromedriver_path(timeout=None):
+    # timeout: รอ webdriver-manager ไม่เกินเวลาที่เหลือของ job (ดาวน์โหลดค้างได้และไม่มี timeout ของตัวเอง)
+    global _chromedriver_path
+    load_selenium()
+    if _chromedriver_path is None:
         if USE_WEBDRIVER_MANAGER:
-            try: service = ChromeService(ChromeDriverManager().install()); driver = webdriver.Chrome(service=service, options=options); logging.info("เปิด Chrome (Headless) สำเร็จ")
+            try:
+                with metrics.span('chromedriver_install'):
+                    outcome = {}; installer = threading.Thread(target=lambda: outcome.update(path=ChromeDriverManager().install()), daemon=True)
+                    installer.start(); installer.join(timeout)
+                    if installer.is_alive(): raise WebDriverException(f"ติดตั้ง ChromeDriver เกินเวลา ({timeout:.0f} วินาที)")
+                    if 'path' not in outcome: raise WebDriverException("webdriver-manager ติดตั้ง ChromeDriver ไม่สำเร็จ")
+                    _chromedriver_path = outcome['path']
             except Exception as e_wdm: logging.warning(f"wdm ล้มเหลว ({e_wdm}), ลอง Path สำรอง..."); raise
-        else:
-             if os.path.exists(CHROMEDRIVER_FALLBACK_PATH): service = ChromeService(executable_path=CHROMEDRIVER_FALLBACK_PATH); driver = webdriver.Chrome(service=service, options=options); logging.info("เปิด Chrome (Headless) สำรองสำเร็จ")
-             else: raise WebDriverException("ไม่พบ ChromeDriver")
+        elif os.path.exists(CHROMEDRIVER_FALLBACK_PATH): _chromedriver_path = CHROMEDRIVER_FALLBACK_PATH
+        else: raise WebDriverException("ไม่พบ ChromeDriver")
+    return _chromedriver_path
+
+def open_chrome_driver(timeout=None):
+    driver = None; service = None
+    try: # เปิด Browser
+        options = build_chrome_options()
+        service = ChromeService(executable_path=resolve_chromedriver_path(timeout))
+        with metrics.span('browser_launch'): driver = webdriver.Chrome(service=service, options=options)
+        logging.info("เปิด Chrome (Headless) สำเร็จ")
     except Exception as e_init: logging.error(f"Error เริ่มต้น Selenium: {e_init}"); return None
+    return driver
+
+
+# --- Pool ของ Chrome (Headless) ที่เปิดค้างไว้ สำหรับโหมด --watch / รันซ้ำ ---
+class DriverPool:
+    # acquire() คืน driver ที่ผ่าน health check, release() คืน driver เข้า pool หรือปิดทิ้งเมื่อใช้ครบ max_uses / พัง
+    # ใช้จากหลาย thread พร้อมกันได้ (iter_station_results ดึงได้ size หน้าพร้อมกัน, 1 Chrome ต่อ thread)
+    def __init__(self, size=1, max_uses=None):
+        self.size = max(1, int(size)); self.max_uses = max(1, int(max_uses or DRIVER_MAX_USES)); self.idle = []; self.uses = {}; self.lock = threading.Lock()
+
+    def warm(self):
+        while len(self.idle) < self.size:
+            driver = open_chrome_driver()
+            if not driver: return False
+            with self.lock: self.uses[id(driver)] = 0; self.idle.append(driver)
+        logging.info(f"เตรียม Chrome ไว้ใน pool {len(self.idle)} ตัว"); return True
+
+    @staticmethod
+    def is_healthy(driver):
+        try: return driver.execute_script("return 1;") == 1
+        except Exception: return False
+
+    def acquire(self):
+        while True:
+            with self.lock: driver = self.idle.pop() if self.idle else None
+            if driver is None: break
+            if self.is_healthy(driver): return driver
+            logging.warning("Chrome ใน pool ไม่ตอบสนอง, ปิดและเปิดใหม่"); self._discard(driver)
+        driver = open_chrome_driver()
+        if driver:
+            with self.lock: self.uses[id(driver)] = 0
+        return driver
+
+    def release(self, driver, healthy=True):
+        if not driver: return
+        with self.lock:
+            uses = self.uses[id(driver)] = self.uses.get(id(driver), 0) + 1
+            keep = healthy and uses < self.max_uses and len(self.idle) < self.size
+            if keep: self.idle.append(driver)
+        if not keep: logging.info(f"ปิด Chrome ที่ใช้แล้ว {uses} ครั้ง (healthy={healthy})"); self._discard(driver)
+
+    def _discard(self, driver):
+        with self.lock: self.uses.pop(id(driver), None)
+        try: driver.quit()
+        except Exception as e_quit: logging.error(f"เกิดปัญหาปิด Browser: {e_quit}")
+
+    def close(self):
+        with self.lock: drivers = self.idle; self.idle = []
+        for driver in drivers: self._discard(driver)
+        logging.info("ปิด Chrome ทั้งหมดใน pool แล้ว")
 
-    data_for_sheet = []
+
+# --- ฟังก์ชันสร้าง Headers 2 แถว (วันที่ Q7..Q1 ย้อนหลัง 7 วัน) ---
+# --- วันที่จริงของคอลัมน์ Q7..Q1 (ย้อนหลัง 6 วัน ถึง วันนี้) ---
+def q_column_dates(today=None):
+    today = today or datetime.now()
+    return [today - timedelta(days=i) for i in range(6, -1, -1)]
+
+def build_web_headers(today=None):
+    date_q_values = []
+    thai_month_abbr = ["", "ม.ค.", "ก.พ.", "มี.ค.", "เม.ย.", "พ.ค.", "มิ.ย.", "ก.ค.", "ส.ค.", "ก.ย.", "ต.ค.", "พ.ย.", "ธ.ค."]; thai_day_abbr = ["อา.", "จ.", "อ.", "พ.", "พฤ.", "ศ.", "ส."]
+    for target_date in q_column_dates(today): day_abbr = thai_day_abbr[int(target_date.strftime("%w"))]; day = target_date.day; month_abbr = thai_month_abbr[target_date.month]; date_q_values.append(f"{day_abbr} {day} {month_abbr}")
+    headers = [ "ลำดับ", "สถานี", "ลุ่มน้ำ", "อำเภอ", "จังหวัด", "ระดับตลิ่ง(ม.)"]; headers.extend(date_q_values); headers.extend(["เฉลี่ย", "กราฟ", "ร้อยละความจุ", "แนวโน้ม"])
+    headers_bottom = [ "", "", "", "", "", "ความจุลำน้ำ(ลบ.ม./วินาที)"]; headers_bottom.extend([f"ปริมาณน้ำQ{i}" for i in range(7, 0, -1)]); headers_bottom.extend(["เฉลี่ย ปริมาณน้ำ", "", "", ""])
+    return [headers, headers_bottom]
+
+
+# --- ฟังก์ชันจัดรูปแบบข้อมูลดิบ 17 คอลัมน์ เป็น 2 แถว (บน=ระดับน้ำ, ล่าง=ปริมาณน้ำ) ---
+def format_raw_cols(raw_cols):
+    if len(raw_cols) != 17: return None
+    row_top = []; row_bottom = [] # สร้างแถวข้อมูล
+    for i in range(5): row_top.append(raw_cols[i]); row_bottom.append("")
+    col6_parts = raw_cols[5].split(); row_top.append(col6_parts[0] if len(col6_parts) > 0 else "N/A"); row_bottom.append(col6_parts[-1] if len(col6_parts) > 1 else "N/A")
+    for i in range(6, 13): q_val_parts = raw_cols[i].split(); row_top.append(q_val_parts[0] if len(q_val_parts) > 0 else "N/A"); row_bottom.append(q_val_parts[-1] if len(q_val_parts) > 1 else "N/A")
+    avg_val_parts = raw_cols[13].split(); row_top.append(avg_val_parts[0] if len(avg_val_parts) > 0 else "N/A"); row_bottom.append(avg_val_parts[-1] if len(avg_val_parts) > 1 else "N/A")
+    row_top.append(raw_cols[14]); row_top.append(raw_cols[15]); row_top.append(raw_cols[16]); row_bottom.extend(["", "", ""])
+    return [row_top, row_bottom]
+
+
+# --- JavaScript ดึงข้อความ td ที่แสดงผลของทุกแถวที่ต้องการในครั้งเดียว (แทน is_displayed()/.text ทีละเซลล์) ---
+ROW_CELLS_JS = """
+var ids = arguments[0], out = {};
+for (var i = 0; i < ids.length; i++) {
+    var tr = document.getElementById(ids[i]);
+    if (!tr) { out[ids[i]] = null; continue; }
+    var cells = [], tds = tr.getElementsByTagName('td');
+    for (var j = 0; j < tds.length; j++) {
+        var st = window.getComputedStyle(tds[j]);
+        if (st.display !== 'none' && st.visibility !== 'hidden' && tds[j].getClientRects().length > 0) cells.push(tds[j].innerText);
+    }
+    out[ids[i]] = cells;
+}
+return out;
+"""
+
+def clean_cell_text(text): return ' '.join((text or '').split()).replace('\xa0', ' ')
+
+
+# --- ฟังก์ชันดึงข้อมูลหลายสถานีจากการโหลดหน้าเว็บครั้งเดียว ---
+def scrape_stations_like_web(row_ids=None, pool=None, url=None, timeout=None):
+    # คืน dict {row_id: data_for_sheet 4 แถว หรือ None ถ้าสถานีนั้นล้มเหลว}, คืน None ถ้าโหลดหน้าเว็บไม่สำเร็จ
+    # ถ้าส่ง pool มา จะใช้ Chrome ที่เปิดค้างไว้ (refresh หน้าเดิมแทนการเปิด Browser ใหม่) และคืนเข้า pool หลังใช้
+    # timeout = เวลาทั้งหมดของ job นี้ (โหลดหน้า + รอตาราง), ไม่ระบุใช้ PAGE_LOAD_TIMEOUT_SECONDS / WAIT_TIME_SECONDS เดิม
+    row_ids = [str(r) for r in (row_ids or TARGET_ROW_IDS)]; url = url or TARGET_URL
+    deadline = time.time() + timeout if timeout else None
+    logging.info(f"--- เริ่มต้นดึงข้อมูล Selenium ({len(row_ids)} สถานี: {', '.join(row_ids)}) ---")
+    try: load_selenium()
+    except ImportError as e_import: logging.error(f"ไม่พบไลบรารี Selenium: {e_import}"); return None
+    driver = pool.acquire() if pool else open_chrome_driver(timeout=timeout)
+    if not driver: return None
+    page_load_timeout = max(1, round(deadline - time.time())) if deadline else PAGE_LOAD_TIMEOUT_SECONDS # เวลาที่เหลือหลังเปิด Browser
+
+    results = {}; driver_ok = True
     try:
-        logging.info(f"กำลังเปิด URL: {TARGET_URL} (Page Load Timeout: {PAGE_LOAD_TIMEOUT_SECONDS} วินาที)...")
+        logging.info(f"กำลังเปิด URL: {url} (Page Load Timeout: {page_load_timeout} วินาที)...")
         # --- ตั้งค่า Page Load Timeout ---
-        driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT_SECONDS)
+        driver.set_page_load_timeout(page_load_timeout)
         # --------------------------------
-        driver.get(TARGET_URL) # <<< ลองโหลดหน้าเว็บ
+        with metrics.span('page_load', url=url):
+            if pool and (driver.current_url or '') == url: driver.refresh() # <<< Chrome อุ่นอยู่แล้ว: refresh หน้าเดิม
+            else: driver.get(url) # <<< โหลดหน้าเว็บครั้งเดียวสำหรับทุกสถานี
+        wait_seconds = lambda: max(1, min(WAIT_TIME_SECONDS, deadline - time.time())) if deadline else WAIT_TIME_SECONDS # คำนวณใหม่ก่อนรอแต่ละครั้ง (ไม่ให้ 2 ครั้งรวมกันเกินเวลาที่เหลือของ job)
         table_id = "jqGrid"
-        logging.info(f"โหลด URL สำเร็จ, กำลังรอตาราง ID='{table_id}' และแถว ID='{TARGET_ROW_ID}'...")
-
-        try: # รอ Container และ แถวเป้าหมาย
-            WebDriverWait(driver, WAIT_TIME_SECONDS).until( EC.presence_of_element_located((By.ID, "gbox_" + table_id)) ); logging.info("พบ Container")
-            target_row_element = WebDriverWait(driver, WAIT_TIME_SECONDS).until( EC.element_to_be_clickable((By.ID, TARGET_ROW_ID)) ); logging.info(f"พบแถว ID='{TARGET_ROW_ID}'")
-        except TimeoutException: logging.error(f"Error: หมดเวลารอ ({WAIT_TIME_SECONDS} วิ) ไม่พบตาราง/แถว ID='{TARGET_ROW_ID}' หลังโหลดหน้าเว็บ"); return None
-
-        # --- กำหนด Headers ---
-        today = datetime.now(); date_q_values = []
-        thai_month_abbr = ["", "ม.ค.", "ก.พ.", "มี.ค.", "เม.ย.", "พ.ค.", "มิ.ย.", "ก.ค.", "ส.ค.", "ก.ย.", "ต.ค.", "พ.ย.", "ธ.ค."]; thai_day_abbr = ["อา.", "จ.", "อ.", "พ.", "พฤ.", "ศ.", "ส."]
-        for i in range(6, -1, -1): target_date = today - timedelta(days=i); day_abbr = thai_day_abbr[int(target_date.strftime("%w"))]; day = target_date.day; month_abbr = thai_month_abbr[target_date.month]; date_q_values.append(f"{day_abbr} {day} {month_abbr}")
-        headers = [ "ลำดับ", "สถานี", "ลุ่มน้ำ", "อำเภอ", "จังหวัด", "ระดับตลิ่ง(ม.)"]; headers.extend(date_q_values); headers.extend(["เฉลี่ย", "กราฟ", "ร้อยละความจุ", "แนวโน้ม"])
-        headers_bottom = [ "", "", "", "", "", "ความจุลำน้ำ(ลบ.ม./วินาที)"]; headers_bottom.extend([f"ปริมาณน้ำQ{i}" for i in range(7, 0, -1)]); headers_bottom.extend(["เฉลี่ย ปริมาณน้ำ", "", "", ""])
-        data_for_sheet.append(headers); data_for_sheet.append(headers_bottom); logging.info(f"สร้าง Headers 2 แถว สำเร็จ")
-        # --- ดึงข้อมูลดิบ และ ทำความสะอาด ---
-        try:
-            raw_cols_elements = [td for td in target_row_element.find_elements(By.TAG_NAME, "td") if td.is_displayed()]
-            raw_cols = [' '.join(element.text.split()).replace('\xa0', ' ') for element in raw_cols_elements]
-            logging.info(f"ข้อมูลดิบ (หลัง clean): {raw_cols}")
-            if len(raw_cols) == 17:
-                row_top = []; row_bottom = [] # สร้างแถวข้อมูล
-                for i in range(5): row_top.append(raw_cols[i]); row_bottom.append("")
-                col6_parts = raw_cols[5].split(); row_top.append(col6_parts[0] if len(col6_parts) > 0 else "N/A"); row_bottom.append(col6_parts[-1] if len(col6_parts) > 1 else "N/A")
-                for i in range(6, 13): q_val_parts = raw_cols[i].split(); row_top.append(q_val_parts[0] if len(q_val_parts) > 0 else "N/A"); row_bottom.append(q_val_parts[-1] if len(q_val_parts) > 1 else "N/A")
-                avg_val_parts = raw_cols[13].split(); row_top.append(avg_val_parts[0] if len(avg_val_parts) > 0 else "N/A"); row_bottom.append(avg_val_parts[-1] if len(avg_val_parts) > 1 else "N/A")
-                row_top.append(raw_cols[14]); row_top.append(raw_cols[15]); row_top.append(raw_cols[16]); row_bottom.extend(["", "", ""])
-                data_for_sheet.append(row_top); data_for_sheet.append(row_bottom); logging.info("จัดรูปแบบข้อมูลคล้ายหน้าเว็บสำเร็จ")
-            else: logging.warning(f"ดึงข้อมูลดิบได้ {len(raw_cols)} ไม่ครบ 17"); return None
-        except Exception as row_err: logging.error(f"เกิดปัญหาดึง/จัดรูปแบบแถว ID='{TARGET_ROW_ID}': {row_err}"); return None
+        logging.info(f"โหลด URL สำเร็จ, กำลังรอตาราง ID='{table_id}' และแถวของสถานีที่ต้องการ...")
+
+        wait_start = time.time()
+        try: # รอ Container และ แถวเป้าหมายอย่างน้อย 1 แถว
+            with metrics.span('grid_wait', url=url):
+                WebDriverWait(driver, wait_seconds()).until( EC.presence_of_element_located((By.ID, "gbox_" + table_id)) ); logging.info("พบ Container")
+                WebDriverWait(driver, wait_seconds()).until( lambda d: d.execute_script("return arguments[0].some(function(id){ return document.getElementById(id) !== null; });", row_ids) ); logging.info("พบแถวเป้าหมายในตาราง")
+        except TimeoutException: logging.error(f"Error: หมดเวลารอ ({time.time() - wait_start:.0f} วิ) ไม่พบตาราง/แถว ID={row_ids} หลังโหลดหน้าเว็บ"); return None
+
+        headers = build_web_headers(); logging.info(f"สร้าง Headers 2 แถว สำเร็จ")
+        # --- ดึงข้อมูลดิบทุกสถานีใน DOM pass เดียว ---
+        with metrics.span('dom_read', url=url, stations=len(row_ids)): cells_by_id = driver.execute_script(ROW_CELLS_JS, row_ids) or {}
+        for row_id in row_ids:
+            try:
+                cells = cells_by_id.get(row_id)
+                if cells is None: logging.warning(f"ไม่พบแถว ID='{row_id}' ในตาราง"); results[row_id] = None; continue
+                raw_cols = [clean_cell_text(text) for text in cells]
+                logging.info(f"ข้อมูลดิบ ID='{row_id}' (หลัง clean): {raw_cols}")
+                data_rows = format_raw_cols(raw_cols)
+                if not data_rows: logging.warning(f"ID='{row_id}': ดึงข้อมูลดิบได้ {len(raw_cols)} ไม่ครบ 17"); results[row_id] = None; continue
+                results[row_id] = [row[:] for row in headers] + data_rows; logging.info(f"ID='{row_id}': จัดรูปแบบข้อมูลคล้ายหน้าเว็บสำเร็จ")
+            except Exception as row_err: logging.error(f"เกิดปัญหาดึง/จัดรูปแบบแถว ID='{row_id}': {row_err}"); results[row_id] = None
 
     # --- จัดการ Error ตอนโหลดหน้าเว็บ ---
-    except TimeoutException as page_load_timeout:
-         logging.error(f"Error: หมดเวลา ({PAGE_LOAD_TIMEOUT_SECONDS} วินาที) ในการโหลด URL: {TARGET_URL}")
+    except TimeoutException as e_timeout:
+         logging.error(f"Error: หมดเวลา ({page_load_timeout} วินาที) ในการโหลด URL: {url} ({e_timeout})")
          try: driver.save_screenshot(os.path.join(script_dir,f"screenshot_pageload_timeout.png")); logging.info("บันทึก screenshot...")
          except Exception: pass
-         data_for_sheet = None # คืนค่า None ถ้าโหลดหน้าเว็บ Timeout
+         results = None; driver_ok = False # คืนค่า None ถ้าโหลดหน้าเว็บ Timeout
     # --- จัดการ Error อื่นๆ และ ปิด Browser ---
-    except Exception as e_scrape: logging.error(f"เกิดข้อผิดพลาดระหว่างดึงข้อมูล: {e_scrape}"); import traceback; traceback.print_exc(); data_for_sheet = None
+    except Exception as e_scrape: logging.error(f"เกิดข้อผิดพลาดระหว่างดึงข้อมูล: {e_scrape}"); import traceback; traceback.print_exc(); results = None; driver_ok = False
     finally:
-        if driver:
+        if pool: pool.release(driver, healthy=driver_ok)
+        elif driver:
             try: driver.quit(); logging.info("ปิด Chrome Browser (Headless) แล้ว")
             except Exception as e_quit: logging.error(f"เกิดปัญหาปิด Browser: {e_quit}")
+    return results
+
+
+# --- Transport สำหรับ HTTP fast path (เปลี่ยนเป็น fixture/response ที่บันทึกไว้ได้ตอนทดสอบ) ---
+class RequestsTransport:
+    # ใช้ requests.Session เดียว (connection pool) ตลอดการรัน; get() คืน (status, headers, text)
+    def __init__(self, timeout=HTTP_TIMEOUT_SECONDS, pool_size=4):
+        if not load_requests(): raise RuntimeError("ไม่พบไลบรารี requests")
+        self.timeout = timeout; self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=1)
+        self.session.mount('http://', adapter); self.session.mount('https://', adapter)
+        self.session.headers.update({'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/110.0.0.0 Safari/537.36', 'Referer': TARGET_URL})
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        response = self.session.get(url, params=params, headers=headers, timeout=timeout or self.timeout)
+        return response.status_code, dict(response.headers), response.text
+
+    def close(self): self.session.close()
+
+
+class RecordedTransport:
+    # คืน response ที่บันทึกไว้ {url: text หรือ (status, headers, text)} แทนเว็บจริง
+    def __init__(self, responses): self.responses = dict(responses); self.calls = []
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        self.calls.append((url, params, headers)); recorded = self.responses.get(url)
+        if recorded is None: return 404, {}, ''
+        return recorded if isinstance(recorded, tuple) else (200, {}, recorded)
+
+    def close(self): pass
+
+
+_default_transport = None
+def get_default_transport():
+    global _default_transport
+    if _default_transport is None: _default_transport = RequestsTransport()
+    return _default_transport
+
+
+# --- ฟังก์ชันหา url ข้อมูลของ jqGrid จาก HTML/JS ของหน้าเว็บ ---
+def discover_grid_data_url(page_html, page_url=None):
+    page_url = page_url or TARGET_URL
+    grid_call = re.search(r'jqGrid\s*\(\s*\{(.*?)\}\s*\)', page_html, re.S)
+    match = re.search(r'\burl\s*:\s*[\'"]([^\'"]+)[\'"]', grid_call.group(1) if grid_call else page_html)
+    return urljoin(page_url, html_lib.unescape(match.group(1))) if match else None
+
+
+def strip_cell_html(value):
+    text = re.sub(r'<br\s*/?>', ' ', str(value if value is not None else ''), flags=re.I); text = re.sub(r'<[^>]+>', ' ', text)
+    return clean_cell_text(html_lib.unescape(text))
+
+
+# --- ฟังก์ชันแปลงข้อมูลของ jqGrid (JSON {rows:[{id, cell:[...]}]} / [[id, ...]] หรือ XML <rows><row id><cell>) เป็น {row_id: [ข้อความแต่ละเซลล์]} ---
+def parse_grid_rows(payload_text):
+    rows_by_id = {}; payload_text = (payload_text or '').strip()
+    if payload_text.startswith('<'):
+        root = ET.fromstring(payload_text)
+        for row in root.iter('row'): rows_by_id[str(row.get('id'))] = [strip_cell_html(''.join(cell.itertext())) for cell in row.findall('cell')]
+        return rows_by_id
+    payload = json.loads(payload_text)
+    rows = payload.get('rows', []) if isinstance(payload, dict) else payload
+    for i, row in enumerate(rows):
+        if isinstance(row, dict):
+            row_id = row.get('id', i + 1); cells = row.get('cell') if 'cell' in row else [v for k, v in row.items() if k != 'id']
+        else: row_id = row[0] if row else i + 1; cells = row[1:] # แถวแบบ array: ช่องแรกเป็น id (jsonReader id: 0) ไม่ใช่ข้อมูลของเซลล์
+        rows_by_id[str(row_id)] = [strip_cell_html(c) for c in cells]
+    return rows_by_id
+
+
+# --- ฟังก์ชันดึงข้อมูลหลายสถานีผ่าน HTTP โดยตรง (ไม่เปิด Browser) ---
+def fetch_stations_http(row_ids=None, transport=None, url=None, cache=None, timeout=None):
+    # คืน dict แบบเดียวกับ scrape_stations_like_web, คืน None ถ้าหาแหล่งข้อมูล/โหลดข้อมูลไม่สำเร็จ
+    # ถ้าส่ง cache มาและทุกสถานีมีข้อมูลของวันนี้แล้ว จะส่ง If-None-Match/If-Modified-Since และใช้ข้อมูลเดิมเมื่อได้ 304
+    # timeout = เวลาทั้งหมดของการดึงผ่าน HTTP (แต่ละ request ใช้ไม่เกินเวลาที่เหลือ และไม่เกิน HTTP_TIMEOUT_SECONDS)
+    row_ids = [str(r) for r in (row_ids or TARGET_ROW_IDS)]; url = url or TARGET_URL; deadline = time.time() + timeout if timeout else None
+    request_timeout = lambda: max(1, min(HTTP_TIMEOUT_SECONDS, deadline - time.time())) if deadline else None
+    logging.info(f"--- เริ่มต้นดึงข้อมูลผ่าน HTTP ({len(row_ids)} สถานี) ---")
+    try:
+        http_entry = cache.http.get(url, {}) if cache else {}
+        transport = transport or get_default_transport(); data_url = (GRID_DATA_URL if url == TARGET_URL else None) or http_entry.get('data_url')
+        if not data_url:
+            with metrics.span('http_page', url=url): status, _, page_html = transport.get(url, timeout=request_timeout())
+            if status != 200: logging.warning(f"HTTP: โหลดหน้าเว็บไม่สำเร็จ (status {status})"); return None
+            data_url = discover_grid_data_url(page_html, url)
+            if not data_url: logging.warning("HTTP: ไม่พบ url ข้อมูลของ jqGrid ในหน้าเว็บ"); return None
+        cached_blocks = {rid: cache.cached_block(rid) for rid in row_ids} if cache else {}; request_headers = {}
+        if cached_blocks and all(cached_blocks.values()):
+            if http_entry.get('etag'): request_headers['If-None-Match'] = http_entry['etag']
+            if http_entry.get('last_modified'): request_headers['If-Modified-Since'] = http_entry['last_modified']
+        logging.info(f"HTTP: กำลังโหลดข้อมูลตารางจาก {data_url}" + (" (conditional)" if request_headers else ""))
+        with metrics.span('http_data', url=url): status, response_headers, payload_text = transport.get(data_url, params={'rows': 10000, 'page': 1}, headers=request_headers or None, timeout=request_timeout())
+        if status == 304 and request_headers: logging.info("HTTP: 304 Not Modified, ใช้ข้อมูลเดิมจาก cache"); return cached_blocks
+        if status != 200: logging.warning(f"HTTP: โหลดข้อมูลตารางไม่สำเร็จ (status {status})"); return None
+        with metrics.span('http_parse', url=url): rows_by_id = parse_grid_rows(payload_text)
+        if cache:
+            response_headers = {k.lower(): v for k, v in (response_headers or {}).items()}
+            cache.http[url] = {'data_url': data_url, 'etag': response_headers.get('etag'), 'last_modified': response_headers.get('last-modified'), 'checked_at': time.time()}
+    except Exception as e_http: logging.warning(f"HTTP: ดึง/แปลงข้อมูลไม่สำเร็จ: {e_http}"); return None
+
+    headers = build_web_headers(); results = {}
+    for row_id in row_ids:
+        data_rows = format_raw_cols(rows_by_id[row_id]) if row_id in rows_by_id else None
+        if not data_rows: logging.warning(f"HTTP: ไม่พบ/จัดรูปแบบแถว ID='{row_id}' ไม่ได้"); results[row_id] = None; continue
+        results[row_id] = [row[:] for row in headers] + data_rows; logging.info(f"HTTP: ID='{row_id}' จัดรูปแบบสำเร็จ")
+    return results
+
+
+# --- ฟังก์ชันดึงข้อมูลตาม FETCH_MODE: HTTP ก่อน, สถานีที่ไม่สำเร็จใช้ Selenium สำรองอัตโนมัติ ---
+def scrape_stations(row_ids=None, transport=None, fetch_mode=None, pool=None, url=None, timeout=None, cache=None):
+    # timeout = เวลาทั้งหมดของ job: HTTP ใช้ก่อน แล้ว Selenium สำรองได้เวลาที่เหลือ
+    row_ids = [str(r) for r in (row_ids or TARGET_ROW_IDS)]; fetch_mode = fetch_mode or FETCH_MODE; results = {}; deadline = time.time() + timeout if timeout else None
+    if fetch_mode in ('auto', 'http'): results = fetch_stations_http(row_ids, transport=transport, url=url, cache=cache, timeout=timeout) or {}
+    missing_ids = [rid for rid in row_ids if not results.get(rid)]
+    if missing_ids and fetch_mode != 'http':
+        if fetch_mode == 'auto': logging.info(f"ใช้ Selenium สำรองสำหรับ {len(missing_ids)} สถานี: {missing_ids}")
+        results.update(scrape_stations_like_web(missing_ids, pool=pool, url=url, timeout=max(1, deadline - time.time()) if deadline else None) or {})
+    return {rid: results.get(rid) for rid in row_ids}
+
+
+# --- Cache ผลการดึงข้อมูลล่าสุดต่อสถานี (ข้อมูล 2 แถว + hash) และ ETag/Last-Modified ต่อหน้าเว็บ ---
+class ResponseCache:
+    def __init__(self, path=None, ttl=None):
+        self.path = path or os.path.join(script_dir, RESPONSE_CACHE_FILE); self.ttl = CACHE_TTL_SECONDS if ttl is None else ttl
+        self.stations = {}; self.http = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f: data = json.load(f)
+            self.stations = data.get('stations', {}); self.http = data.get('http', {})
+        except FileNotFoundError: pass
+        except Exception as e: logging.warning(f"อ่าน '{self.path}' ไม่ได้ ({e}), เริ่ม cache ใหม่")
+
+    def save(self):
+        try:
+            with open(self.path, 'w', encoding='utf-8') as f: json.dump({'stations': self.stations, 'http': self.http}, f, ensure_ascii=False)
+        except Exception as e: logging.warning(f"บันทึก '{self.path}' ไม่ได้: {e}")
+
+    @staticmethod
+    def content_hash(full_data, today=None):
+        # รวมวันที่ไว้ใน hash ด้วย: ขึ้นวันใหม่ถือว่าเปลี่ยนเสมอ (คอลัมน์ Q7..Q1 เลื่อนวัน และต้องมี Log ของวันใหม่)
+        today = (today or datetime.now()).strftime('%Y-%m-%d')
+        return hashlib.sha256(json.dumps([today, full_data[2:]], ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def cached_block(self, row_id, today=None):
+        entry = self.stations.get(str(row_id)); today = today or datetime.now()
+        if not entry or entry.get('date') != today.strftime('%Y-%m-%d'): return None
+        return build_web_headers(today) + [row[:] for row in entry['rows']]
+
+    def is_fresh(self, row_id, today=None):
+        entry = self.stations.get(str(row_id))
+        return bool(self.ttl > 0 and entry and time.time() - entry.get('checked_at', 0) < self.ttl and self.cached_block(row_id, today))
+
+    def update(self, row_id, full_data, today=None):
+        # บันทึกว่าตรวจสอบแล้ว คืน True ถ้าข้อมูลเปลี่ยนจากครั้งก่อน
+        today = today or datetime.now(); new_hash = self.content_hash(full_data, today); entry = self.stations.get(str(row_id), {}); now = time.time()
+        changed = entry.get('hash') != new_hash
+        self.stations[str(row_id)] = {'hash': new_hash, 'rows': [row[:] for row in full_data[2:]], 'date': today.strftime('%Y-%m-%d'), 'checked_at': now, 'changed_at': now if changed else entry.get('changed_at', now)}
+        return changed
+
+    def invalidate(self, row_ids):
+        for rid in row_ids:
+            if str(rid) in self.stations: self.stations[str(rid)]['hash'] = None
+
+
+# --- ดึงข้อมูลหลายหน้าพร้อมกัน: แยก job ตาม URL แล้วกระจายไปหลาย process ---
+def group_station_jobs(row_ids=None):
+    jobs = {}
+    for rid in [str(r) for r in (TARGET_ROW_IDS if row_ids is None else row_ids)]: jobs.setdefault(STATION_PAGES.get(rid, TARGET_URL), []).append(rid)
+    return list(jobs.items())
+
+
+def available_memory_mb():
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'): return int(line.split()[1]) // 1024
+    except Exception: pass
+    return None
+
+
+def plan_worker_count(num_jobs, max_workers=None):
+    # จำกัดจำนวน process ตาม MAX_WORKERS, CPU (2 ต่อ core เพราะส่วนใหญ่รอ network) และ RAM ที่เหลือ (ประมาณ WORKER_MEMORY_MB ต่อ Chrome)
+    limits = [num_jobs, max_workers or MAX_WORKERS, 2 * (os.cpu_count() or 1)]; free_mb = available_memory_mb()
+    if free_mb is not None: limits.append(free_mb // WORKER_MEMORY_MB)
+    return max(1, min(limits))
+
+
+def scrape_job(url, row_ids, timeout, cache=None, config=None, jsonl_path=None):
+    # รันใน worker process: แต่ละ process เปิด Chrome ของตัวเอง (ถ้า HTTP fast path ไม่สำเร็จ)
+    # cache เป็นสำเนาใน worker จึงคืนค่า ETag/Last-Modified ของหน้านี้กลับไปให้ process หลัก
+    # config ส่งมาจาก process หลัก (worker แบบ spawn import โมดูลใหม่โดยยังไม่ได้อ่าน config)
+    # jsonl_path = ไฟล์ JSON lines ที่ process หลักใช้จริง (--metrics-jsonl ไม่ได้อยู่ใน config)
+    if config is not None and config != config_values: apply_config(config)
+    if jsonl_path is not None: metrics.jsonl_path = jsonl_path
+    # คืน span ที่เกิดใน worker ด้วย (JSON lines เขียนจาก worker แล้ว) เพื่อให้ summary ของ process หลักครบ
+    first_span = len(metrics.spans); results = scrape_stations(row_ids, url=url, timeout=timeout, cache=cache)
+    return url, results, cache.http.get(url) if cache else None, metrics.spans[first_span:]
+
+
+def run_job_process(result_conn, url, row_ids, timeout, cache, config, jsonl_path):
+    # รันใน worker process: แยก process group ของตัวเอง เพื่อให้ kill_job_process ปิด chromedriver/Chrome ที่ job นี้เปิดไปด้วย
+    # ส่งผลกลับทาง Pipe ของ job นี้เอง (Queue ที่ใช้ร่วมกันอาจค้าง ถ้า process ถูก kill ระหว่างเขียน)
+    if hasattr(os, 'setpgrp'): os.setpgrp()
+    try: result_conn.send((scrape_job(url, row_ids, timeout, cache, config, jsonl_path), None))
+    except Exception as e_job: result_conn.send((None, repr(e_job)))
+    finally: result_conn.close()
+
+
+def kill_job_process(process):
+    # ปิด worker ที่เกินเวลาพร้อม process ลูก (chromedriver + Chrome); process.join() ไม่ค้างเพราะ process ถูก kill แล้ว
+    try:
+        if os.name == 'nt': subprocess.run(['taskkill', '/F', '/T', '/PID', str(process.pid)], capture_output=True, timeout=15)
+        else: os.killpg(process.pid, signal.SIGKILL)
+    except Exception: pass # ยังไม่ได้ setpgrp / จบไปแล้ว
+    if process.is_alive(): process.kill()
+    process.join(5)
+
+
+def iter_station_results(row_ids=None, pool=None, max_workers=None, job_timeout=None, cache=None):
+    # yield (url, {row_id: data_for_sheet}) ทันทีที่แต่ละ job เสร็จ แทนการรอ job ที่ช้าที่สุด
+    jobs = group_station_jobs(row_ids); job_timeout = job_timeout or JOB_TIMEOUT_SECONDS
+    workers = plan_worker_count(len(jobs), max_workers)
+    if pool and pool.size > 1 and len(jobs) > 1: # โหมด --watch: ดึงพร้อมกันได้ pool.size หน้า, แต่ละ thread ยืม Chrome ของตัวเองจาก pool
+        logging.info(f"--- ดึงข้อมูล {len(jobs)} หน้า พร้อมกัน {min(pool.size, len(jobs))} thread (Chrome จาก pool) ---")
+        with ThreadPoolExecutor(max_workers=min(pool.size, len(jobs))) as executor:
+            futures = {executor.submit(scrape_stations, ids, pool=pool, url=url, timeout=job_timeout, cache=cache): (url, ids) for url, ids in jobs}
+            for future in as_completed(futures):
+                url, ids = futures[future]
+                try: results = future.result()
+                except Exception as e_job: logging.error(f"job '{url}' ผิดพลาด: {e_job}"); results = {rid: None for rid in ids}
+                yield url, results
+        return
+    if pool or workers == 1: # pool ขนาด 1 / มีหน้าเดียว (ทำทีละหน้าใน process เดียว) หรือมี job เดียว
+        for url, ids in jobs: yield url, scrape_stations(ids, pool=pool, url=url, timeout=job_timeout, cache=cache)
+        return
+    logging.info(f"--- ดึงข้อมูล {len(jobs)} หน้า พร้อมกัน {workers} process (timeout {job_timeout} วินาที/job) ---")
+    # 1 process ต่อ job (ไม่ใช้ ProcessPoolExecutor: ยกเลิก job ที่ค้างไม่ได้ และ atexit ของมันจะรอ worker ที่ค้างจนจบเอง)
+    # แต่ละ job จำกัดเวลาเองใน worker (timeout); ถ้าเกิน job_timeout + 15 วินาที (เผื่อปิด Browser) จะ kill ทั้ง process group
+    queued = list(jobs); running = {} # {reader: (url, ids, process, deadline)}
+    try:
+        while queued or running:
+            while queued and len(running) < workers:
+                url, ids = queued.pop(0); reader, writer = multiprocessing.Pipe(duplex=False)
+                process = multiprocessing.Process(target=run_job_process, args=(writer, url, ids, job_timeout, cache, config_values, metrics.jsonl_path), daemon=True); process.start(); writer.close()
+                running[reader] = (url, ids, process, time.time() + job_timeout + 15)
+            for reader in wait_connections(list(running), timeout=max(0.1, min(job[3] for job in running.values()) - time.time())):
+                url, ids, process, _ = running.pop(reader)
+                try: outcome, error = reader.recv()
+                except EOFError: process.join(5); outcome = None; error = f"process จบก่อนส่งผลลัพธ์ (exitcode {process.exitcode})"
+                reader.close(); process.join(5)
+                if error: logging.error(f"job '{url}' ผิดพลาด: {error}"); yield url, {rid: None for rid in ids}; continue
+                url, results, http_entry, worker_spans = outcome; metrics.spans.extend(worker_spans)
+                if cache and http_entry: cache.http[url] = http_entry
+                yield url, results
+            for reader, (url, ids, process, deadline) in list(running.items()):
+                if time.time() < deadline: continue
+                logging.error(f"job '{url}' เกินเวลา, ปิด process {process.pid} และข้ามสถานี {ids}")
+                del running[reader]; kill_job_process(process); reader.close(); yield url, {rid: None for rid in ids}
+    finally:
+        for reader, (_, _, process, _) in running.items(): kill_job_process(process); reader.close() # ถูกหยุดกลางคัน (เช่น Ctrl+C)
+
+
+# --- ฟังก์ชันดึงข้อมูลสถานีเดียว (คงไว้เพื่อใช้งานแบบเดิม) ---
+def scrape_format_like_web(row_id=None):
+    row_id = str(row_id or TARGET_ROW_ID)
+    results = scrape_stations([row_id])
+    data_for_sheet = results.get(row_id) if results else None
     return data_for_sheet if data_for_sheet and len(data_for_sheet) == 4 else None # ตรวจสอบให้ดีขึ้นก่อนคืนค่า
 
 
+# --- ฟังก์ชันรวมข้อมูลหลายสถานี เป็น Headers 2 แถว + ข้อมูล 2 แถวต่อสถานี ---
+def merge_station_blocks(blocks):
+    blocks = [b for b in blocks if b and len(b) == 4]
+    if not blocks: return None
+    merged = [row[:] for row in blocks[0][:2]]
+    for block in blocks: merged.extend(row[:] for row in block[2:])
+    return merged
+
+
+# --- ฟังก์ชันสร้างแถวสำหรับชีตล่าสุด (Headers 2 แถว + ข้อมูล 2 แถวต่อสถานี, เติม timestamp ท้ายแถวล่าง) ---
+def build_latest_rows(data_to_write, run_timestamp=None):
+    num_headers = 2; data_with_timestamp = [row[:] for row in data_to_write]
+    run_timestamp = run_timestamp or datetime.now().strftime('%Y-%m-%d %H:%M:%S'); timestamp_header = "วันที่ดึงข้อมูล"
+    if timestamp_header not in data_with_timestamp[0]: data_with_timestamp[0].append(timestamp_header)
+    if len(data_with_timestamp[1]) < len(data_with_timestamp[0]): data_with_timestamp[1].append("")
+    for top in range(num_headers, len(data_with_timestamp), 2): # เติม timestamp ท้ายแถวล่างของแต่ละสถานี
+        while len(data_with_timestamp[top]) < len(data_with_timestamp[0]): data_with_timestamp[top].append("")
+        while len(data_with_timestamp[top + 1]) < len(data_with_timestamp[0]) - 1: data_with_timestamp[top + 1].append("")
+        data_with_timestamp[top + 1].append(run_timestamp)
+    return data_with_timestamp
+
+
+# --- ฟังก์ชันสร้าง Headers 2 แถวของชีต Log ---
+def build_log_headers(today=None):
+    today = today or datetime.now(); formatted_date = today.strftime('%d/%m/%Y'); timestamp_header = "วันที่ดึงข้อมูล"
+    log_header_top = ["ลำดับ", "สถานี", "ลุ่มน้ำ", "อำเภอ", "จังหวัด","ระดับตลิ่ง(ม.)", f"ระดับน้ำ ('{formatted_date})", f"วันที่ ({formatted_date})", "ร้อยละความจุ(%)", "สถานะ/แนวโน้ม", timestamp_header]
+    log_header_bottom = ["", "", "", "", "", "ความจุลำน้ำ(ลบ.ม./วินาที)", f"ปริมาณน้ำ ('{formatted_date})", "", "", "", ""]
+    return [log_header_top, log_header_bottom]
+
+
+def pad_log_rows(log_row_top, log_row_bottom, run_timestamp):
+    num_final_headers = 11
+    while len(log_row_top) < num_final_headers : log_row_top.append('')
+    while len(log_row_bottom) < num_final_headers -1 : log_row_bottom.append('')
+    log_row_bottom.append(run_timestamp)
+    return [log_row_top, log_row_bottom]
+
+
+# --- ฟังก์ชันสร้าง Headers และแถวข้อมูลสำหรับชีต Log จากข้อมูล 4 แถวของสถานีเดียว ---
+def build_log_rows(full_data, today=None, run_timestamp=None):
+    today = today or datetime.now(); formatted_date = today.strftime('%d/%m/%Y')
+    headers_for_log = build_log_headers(today); data_row_top = full_data[2]; data_row_bottom = full_data[3]
+    log_row_top = []; log_row_bottom = []
+    for i in range(6): log_row_top.append(data_row_top[i]); log_row_bottom.append(data_row_bottom[i])
+    q1_val_parts_top = data_row_top[12].split(); log_row_top.append(q1_val_parts_top[0] if len(q1_val_parts_top) > 0 else "N/A")
+    q1_val_parts_bottom = data_row_bottom[12].split(); log_row_bottom.append(q1_val_parts_bottom[0] if len(q1_val_parts_bottom) > 0 else "N/A")
+    log_row_top.append(formatted_date); log_row_bottom.append("") # วันที่ วว/ดด/ปปปป
+    log_row_top.append(data_row_top[15]); log_row_top.append(data_row_top[16]); log_row_bottom.append(""); log_row_bottom.append("")
+    run_timestamp = run_timestamp or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return headers_for_log, pad_log_rows(log_row_top, log_row_bottom, run_timestamp)
+
+
+# --- ฟังก์ชันสร้างแถวชีต Log (2 แถว) จาก reading ที่เก็บใน ReadingStore ---
+def build_log_rows_from_reading(reading):
+    # ใช้ข้อความเดิมจากหน้าเว็บ (เหมือนเขียนแบบ RAW เดิม); แถวเก่าที่ยังไม่มีข้อความ จึงแปลงจากตัวเลข
+    water_level = reading.get('water_level_text') or format_reading_value(reading['water_level']); discharge = reading.get('discharge_text') or format_reading_value(reading['discharge'])
+    log_row_top = [reading['seq'], reading['name'], reading['basin'], reading['district'], reading['province'], reading['bank_level'], water_level,
+                   datetime.strptime(reading['date'], '%Y-%m-%d').strftime('%d/%m/%Y'), reading['percent_capacity'] or '', reading['trend'] or '']
+    log_row_bottom = ["", "", "", "", "", reading['bank_capacity'], discharge, "", "", ""]
+    return pad_log_rows(log_row_top, log_row_bottom, reading['scraped_at'])
+
+
+# --- แปลงค่าข้อความจากเว็บเป็นตัวเลข ("N/A", "-", ช่องว่าง = None) และกลับเป็นข้อความสำหรับชีต ---
+def parse_reading_value(text):
+    try: return float(str(text).replace(',', '').strip())
+    except (TypeError, ValueError): return None
+
+def format_reading_value(value):
+    if value is None: return "N/A"
+    return str(int(value)) if value.is_integer() else repr(value) # ไม่ปัดเลขนัยสำคัญ (เช่น 12345.67, 123456789)
+
+
+# --- ที่เก็บข้อมูลในเครื่อง (SQLite): 1 แถวต่อ (สถานี, วันที่) พร้อมสถานะว่าส่งเข้าชีต Log แล้วหรือยัง ---
+class ReadingStore:
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS readings (
+        station TEXT NOT NULL, date TEXT NOT NULL, water_level REAL, discharge REAL, water_level_text TEXT, discharge_text TEXT,
+        seq TEXT, name TEXT, basin TEXT, district TEXT, province TEXT, bank_level TEXT, bank_capacity TEXT, percent_capacity TEXT, trend TEXT,
+        scraped_at TEXT NOT NULL, synced INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (station, date)
+    );
+    CREATE INDEX IF NOT EXISTS readings_unsynced ON readings (synced) WHERE synced = 0;
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(script_dir, READINGS_DB_FILE)
+        self.conn = sqlite3.connect(self.path); self.conn.row_factory = sqlite3.Row; self.conn.executescript(self.SCHEMA)
+        existing = {row['name'] for row in self.conn.execute("PRAGMA table_info(readings)")} # ฐานข้อมูลเดิมที่สร้างก่อนมีคอลัมน์ข้อความ
+        for column in ('water_level_text', 'discharge_text'):
+            if column not in existing:
+                with self.conn: self.conn.execute(f"ALTER TABLE readings ADD COLUMN {column} TEXT")
+
+    def close(self): self.conn.close()
+
+    def upsert(self, readings):
+        # re-run วันเดียวกันจะอัปเดตค่าในแถวเดิม (ไม่สร้างแถวซ้ำ) และไม่เปลี่ยนสถานะ synced
+        columns = ['station', 'date', 'water_level', 'discharge', 'water_level_text', 'discharge_text', 'seq', 'name', 'basin', 'district', 'province', 'bank_level', 'bank_capacity', 'percent_capacity', 'trend', 'scraped_at']
+        updates = ', '.join(f"{c} = excluded.{c}" for c in columns[2:])
+        with self.conn:
+            self.conn.executemany(f"INSERT INTO readings ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) ON CONFLICT (station, date) DO UPDATE SET {updates}",
+                                  [[r.get(c) for c in columns] for r in readings])
+        return len(readings)
+
+    @staticmethod
+    def station_readings(station, full_data, today=None, scraped_at=None, days=1):
+        # แปลงข้อมูล 4 แถวจากหน้าเว็บเป็น reading รายวัน: days=1 เฉพาะ Q1 (วันนี้), days=7 ครบ Q7..Q1
+        scraped_at = scraped_at or datetime.now().strftime('%Y-%m-%d %H:%M:%S'); top = full_data[2]; bottom = full_data[3]; readings = []
+        for col, target_date in list(zip(range(6, 13), q_column_dates(today)))[-days:]:
+            readings.append({'station': str(station), 'date': target_date.strftime('%Y-%m-%d'), 'water_level': parse_reading_value(top[col]), 'discharge': parse_reading_value(bottom[col]),
+                             'water_level_text': top[col], 'discharge_text': bottom[col],
+                             'seq': top[0], 'name': top[1], 'basin': top[2], 'district': top[3], 'province': top[4], 'bank_level': top[5], 'bank_capacity': bottom[5],
+                             'percent_capacity': top[15] if col == 12 else None, 'trend': top[16] if col == 12 else None, 'scraped_at': scraped_at}) # ร้อยละความจุ/แนวโน้ม มีเฉพาะค่าปัจจุบัน (Q1)
+        return readings
+
+    def record_station(self, station, full_data, today=None, scraped_at=None, backfill=False):
+        # เก็บค่าวันล่าสุด (Q1); backfill=True เติม 6 วันก่อนหน้า (Q7..Q2) เฉพาะวันที่ยังไม่มีในฐานข้อมูล
+        return self.record_stations({station: full_data}, today=today, scraped_at=scraped_at, backfill=backfill)
+
+    def record_stations(self, blocks_by_station, today=None, scraped_at=None, backfill=False):
+        # บันทึกทุกสถานีใน transaction เดียว (commit ทีละสถานีช้ามากเมื่อมีหลายสิบสถานี)
+        latest = []; earlier = []
+        for station, full_data in blocks_by_station.items():
+            readings = self.station_readings(station, full_data, today=today, scraped_at=scraped_at, days=7 if backfill else 1)
+            latest.extend(readings[-1:]); earlier.extend(readings[:-1])
+        if earlier: self.insert_missing(earlier)
+        return self.upsert(latest)
+
+    def insert_missing(self, readings):
+        columns = ['station', 'date', 'water_level', 'discharge', 'water_level_text', 'discharge_text', 'seq', 'name', 'basin', 'district', 'province', 'bank_level', 'bank_capacity', 'percent_capacity', 'trend', 'scraped_at']
+        with self.conn:
+            cursor = self.conn.executemany(f"INSERT INTO readings ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) ON CONFLICT (station, date) DO NOTHING",
+                                           [[r.get(c) for c in columns] for r in readings])
+        return cursor.rowcount
+
+    def reconcile_logged(self, logged_keys):
+        # ทำเครื่องหมาย synced ให้ reading ที่มีอยู่ในชีต Log แล้ว (เทียบจาก (ชื่อสถานี, วันที่))
+        already_logged = [r for r in self.unsynced() if (r['name'], r['date']) in logged_keys]
+        self.mark_synced(already_logged)
+        return len(already_logged)
+
+    def unsynced(self):
+        return [dict(row) for row in self.conn.execute("SELECT * FROM readings WHERE synced = 0 ORDER BY date, station")]
+
+    def mark_synced(self, readings):
+        with self.conn: self.conn.executemany("UPDATE readings SET synced = 1 WHERE station = ? AND date = ?", [(r['station'], r['date']) for r in readings])
+
+    def history(self, station, start_date=None, end_date=None):
+        query = "SELECT * FROM readings WHERE station = ?"; params = [str(station)]
+        if start_date: query += " AND date >= ?"; params.append(str(start_date))
+        if end_date: query += " AND date <= ?"; params.append(str(end_date))
+        return [dict(row) for row in self.conn.execute(query + " ORDER BY date", params)]
+
+
 # --- ฟังก์ชันเขียนทับชีตล่าสุด (ใช้ USER_ENTERED) ---
 def update_latest_sheet(service, data_to_write):
-    # ... (โค้ดส่วนนี้เหมือนเดิมเป๊ะ) ...
+    # รับ Headers 2 แถว + ข้อมูล 2 แถวต่อสถานี (สถานีเดียว = 4 แถว เหมือนเดิม)
     sheet_name = SHEET_NAME_LATEST; logging.info(f"--- เริ่มต้นอัปเดตชีตล่าสุด '{sheet_name}' ---")
     if not service: logging.error("ไม่มี Service"); return False
-    if not data_to_write or len(data_to_write) != 4: logging.error("ข้อมูลเขียนชีตล่าสุดไม่ถูกต้อง"); return False
-    num_headers = 2; num_data_rows = 2; data_with_timestamp = [row[:] for row in data_to_write]
+    if not data_to_write or len(data_to_write) < 4 or len(data_to_write) % 2 != 0: logging.error("ข้อมูลเขียนชีตล่าสุดไม่ถูกต้อง"); return False
     try:
         logging.info(f"กำลังล้างชีต '{sheet_name}'..."); clear_range = f"{sheet_name}!A1:Z"
         service.spreadsheets().values().clear(spreadsheetId=SPREADSHEET_ID, range=clear_range).execute(); logging.info("ล้างชีตสำเร็จ")
-        run_timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S'); timestamp_header = "วันที่ดึงข้อมูล"
-        if timestamp_header not in data_with_timestamp[0]: data_with_timestamp[0].append(timestamp_header)
-        if len(data_with_timestamp[1]) < len(data_with_timestamp[0]): data_with_timestamp[1].append("")
-        while len(data_with_timestamp[2]) < len(data_with_timestamp[0]): data_with_timestamp[2].append("")
-        while len(data_with_timestamp[3]) < len(data_with_timestamp[0]) - 1: data_with_timestamp[3].append("")
-        data_with_timestamp[3].append(run_timestamp)
+        data_with_timestamp = build_latest_rows(data_to_write)
         write_range = f"{sheet_name}!A1"; body = {'values': data_with_timestamp}
         logging.info(f"กำลังเขียน {len(data_with_timestamp)} แถว ลงชีต '{sheet_name}' (valueInputOption=USER_ENTERED)...")
         result = service.spreadsheets().values().update(spreadsheetId=SPREADSHEET_ID, range=write_range, valueInputOption='USER_ENTERED', body=body).execute()
@@ -180,30 +835,15 @@ def update_latest_sheet(service, data_to_write):
 
 # --- ฟังก์ชันเขียนต่อท้ายชีต Log (ใช้ RAW และ Header Format DD/MM/YYYY ที่ถูกต้อง) ---
 def append_data_to_log_sheet(service, full_data):
-    # ... (โค้ดส่วนนี้เหมือนเดิมเป๊ะ) ...
     sheet_name = SHEET_NAME_LOG; logging.info(f"--- เริ่มต้นเขียนข้อมูลล่าสุดต่อท้ายชีต Log '{sheet_name}' ---")
     if not service: logging.error("ไม่มี Service object"); return False
     if not full_data or len(full_data) != 4: logging.error("ข้อมูล Input Log ไม่ถูกต้อง"); return False
     try:
-        today = datetime.now(); formatted_date = today.strftime('%d/%m/%Y'); timestamp_header = "วันที่ดึงข้อมูล"
-        log_header_top = ["ลำดับ", "สถานี", "ลุ่มน้ำ", "อำเภอ", "จังหวัด","ระดับตลิ่ง(ม.)", f"ระดับน้ำ ('{formatted_date})", f"วันที่ ({formatted_date})", "ร้อยละความจุ(%)", "สถานะ/แนวโน้ม", timestamp_header]
-        log_header_bottom = ["", "", "", "", "", "ความจุลำน้ำ(ลบ.ม./วินาที)", f"ปริมาณน้ำ ('{formatted_date})", "", "", "", ""]
-        headers_for_log = [log_header_top, log_header_bottom]; data_row_top = full_data[2]; data_row_bottom = full_data[3]
-        log_row_top = []; log_row_bottom = []
-        for i in range(6): log_row_top.append(data_row_top[i]); log_row_bottom.append(data_row_bottom[i])
-        q1_val_parts_top = data_row_top[12].split(); log_row_top.append(q1_val_parts_top[0] if len(q1_val_parts_top) > 0 else "N/A")
-        q1_val_parts_bottom = data_row_bottom[12].split(); log_row_bottom.append(q1_val_parts_bottom[0] if len(q1_val_parts_bottom) > 0 else "N/A")
-        log_row_top.append(formatted_date); log_row_bottom.append("") # วันที่ วว/ดด/ปปปป
-        log_row_top.append(data_row_top[15]); log_row_top.append(data_row_top[16]); log_row_bottom.append(""); log_row_bottom.append("")
+        headers_for_log, log_rows = build_log_rows(full_data)
         data_to_append_to_log = []; check_range = f"{sheet_name}!A1"; result = service.spreadsheets().values().get(spreadsheetId=SPREADSHEET_ID, range=check_range).execute(); existing_values = result.get('values', [])
-        run_timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S');
         if not existing_values: logging.info(f"ชีต '{sheet_name}' ว่าง, เขียน Header"); data_to_append_to_log.extend(headers_for_log)
         else: logging.info(f"ชีต '{sheet_name}' มีข้อมูลแล้ว, เขียนเฉพาะข้อมูลใหม่")
-        num_final_headers = len(log_header_top)
-        while len(log_row_top) < num_final_headers : log_row_top.append('')
-        while len(log_row_bottom) < num_final_headers -1 : log_row_bottom.append('')
-        log_row_bottom.append(run_timestamp)
-        data_to_append_to_log.append(log_row_top); data_to_append_to_log.append(log_row_bottom)
+        data_to_append_to_log.extend(log_rows)
         append_range = f"{sheet_name}!A1"; body = {'values': data_to_append_to_log }
         logging.info(f"กำลังเขียน {len(data_to_append_to_log)} แถวใหม่ ต่อท้ายชีต '{sheet_name}' (valueInputOption=RAW)...")
         result = service.spreadsheets().values().append(spreadsheetId=SPREADSHEET_ID, range=append_range, valueInputOption='RAW', insertDataOption='INSERT_ROWS', body=body).execute()
@@ -212,19 +852,200 @@ def append_data_to_log_sheet(service, full_data):
     except HttpError as error: logging.error(f"เกิด HttpError ตอนเขียนชีต Log '{sheet_name}': {error}"); return False
     except Exception as e: logging.error(f"เกิดข้อผิดพลาดตอนเขียนชีต Log '{sheet_name}': {e}"); import traceback; traceback.print_exc(); return False
 
-# --- ส่วนหลักในการรันสคริปต์ ---
-if __name__ == '__main__':
-    start_time = time.time()
-    logging.info(f"--- Script Start: Selenium Scrape & Log (Row ID {TARGET_ROW_ID} - Added Timeout & Options) ---") # อัปเดตชื่อ Log
-    sheet_service = authenticate_google_sheets()
-    if sheet_service:
-        formatted_data = scrape_format_like_web()
-        # --- แก้ไขการตรวจสอบ formatted_data ---
-        if formatted_data: # ตรวจสอบแค่ว่าไม่เป็น None (เพราะ scrape_format_like_web คืน None ถ้า Error)
-            update_latest_sheet(service=sheet_service, data_to_write=[row[:] for row in formatted_data])
-            append_data_to_log_sheet(service=sheet_service, full_data=formatted_data)
-        # ------------------------------------
-        else: logging.warning(f"ไม่สามารถดึง/จัดรูปแบบข้อมูลจากแถว ID='{TARGET_ROW_ID}' ได้")
-    else: logging.error("ไม่สามารถเชื่อมต่อ Google Sheets API ได้")
+
+# --- Writer แบบ batch: เขียนชีตล่าสุด + ต่อท้าย Log ของทุกสถานีใน spreadsheets().batchUpdate ครั้งเดียว ---
+class SheetsWriter:
+    # เก็บ sheetId และสถานะ "ชีต Log มี Header แล้ว" ไว้ใน SHEETS_STATE_FILE เพื่อข้ามการ get ตรวจสอบในรอบถัดไป
+    def __init__(self, service, state_path=None):
+        self.service = service; self.state_path = state_path or os.path.join(script_dir, SHEETS_STATE_FILE); self.state = self._load_state()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f: state = json.load(f)
+            if state.get('spreadsheet_id') == SPREADSHEET_ID and state.get('sheet_ids', {}).keys() >= {SHEET_NAME_LATEST, SHEET_NAME_LOG}: return state
+        except Exception: pass
+        return {}
+
+    def _save_state(self):
+        try:
+            with open(self.state_path, 'w', encoding='utf-8') as f: json.dump(self.state, f, ensure_ascii=False)
+        except Exception as e: logging.warning(f"บันทึก '{self.state_path}' ไม่ได้: {e}")
+
+    def refresh_state(self):
+        # get เดียวได้ทั้ง sheetId ของทั้ง 2 ชีต และค่า A1 ของชีต Log (ว่าง = ยังไม่มี Header)
+        with metrics.span('sheets_metadata'): result = self.service.spreadsheets().get(spreadsheetId=SPREADSHEET_ID, ranges=[f"{SHEET_NAME_LATEST}!A1", f"{SHEET_NAME_LOG}!A1"], includeGridData=True,
+                                                 fields="sheets(properties(sheetId,title),data(rowData(values(userEnteredValue))))").execute()
+        sheet_ids = {}; log_has_headers = False
+        for sheet in result.get('sheets', []):
+            title = sheet['properties']['title']; sheet_ids[title] = sheet['properties']['sheetId']
+            if title == SHEET_NAME_LOG: log_has_headers = any(row.get('values') for data in sheet.get('data', []) for row in data.get('rowData', []))
+        missing = {SHEET_NAME_LATEST, SHEET_NAME_LOG} - sheet_ids.keys()
+        if missing: raise ValueError(f"ไม่พบชีต {sorted(missing)} ใน Spreadsheet")
+        self.state = {'spreadsheet_id': SPREADSHEET_ID, 'sheet_ids': sheet_ids, 'log_has_headers': log_has_headers}; self._save_state()
+        logging.info(f"โหลดข้อมูลชีตสำเร็จ: {sheet_ids}, Log มี Header แล้ว={log_has_headers}")
+
+    def fetch_logged_keys(self):
+        # อ่านคอลัมน์ A:H ของชีต Log ครั้งเดียว คืน set ของ (ชื่อสถานี, 'YYYY-MM-DD') ที่บันทึกไว้แล้ว
+        with metrics.span('sheets_log_read'): result = self.service.spreadsheets().values().get(spreadsheetId=SPREADSHEET_ID, range=f"{SHEET_NAME_LOG}!A:H").execute()
+        logged_keys = set()
+        for row in result.get('values', []):
+            if len(row) < 8: continue
+            try: logged_keys.add((row[1], datetime.strptime(row[7], '%d/%m/%Y').strftime('%Y-%m-%d')))
+            except ValueError: continue
+        logging.info(f"ชีต '{SHEET_NAME_LOG}' มีข้อมูลแล้ว {len(logged_keys)} รายการ (สถานี, วันที่)")
+        return logged_keys
+
+    @staticmethod
+    def _raw_cells(rows): return [{'values': [{'userEnteredValue': {'stringValue': str(v)}} for v in row]} for row in rows]
+
+    def build_requests(self, blocks, today=None, log_readings=None):
+        # log_readings = reading ที่ยังไม่ส่งจาก ReadingStore (ถ้าไม่ส่งมา จะต่อท้าย Log จาก blocks แบบเดิม)
+        ids = self.state['sheet_ids']; requests_body = []; run_timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        latest_rows = build_latest_rows(merge_station_blocks(blocks), run_timestamp)
+        requests_body.append({'updateCells': {'range': {'sheetId': ids[SHEET_NAME_LATEST], 'startRowIndex': 0, 'startColumnIndex': 0, 'endColumnIndex': 26}, 'fields': 'userEnteredValue'}}) # ล้าง A:Z
+        requests_body.append({'pasteData': {'coordinate': {'sheetId': ids[SHEET_NAME_LATEST], 'rowIndex': 0, 'columnIndex': 0}, 'data': '\n'.join('\t'.join(str(v) for v in row) for row in latest_rows), 'type': 'PASTE_NORMAL', 'delimiter': '\t'}}) # แปลงค่าเหมือน USER_ENTERED
+        log_rows = []
+        if log_readings is None:
+            for block in blocks: log_rows.extend(build_log_rows(block, today=today, run_timestamp=run_timestamp)[1])
+        else:
+            for reading in log_readings: log_rows.extend(build_log_rows_from_reading(reading))
+        if log_rows and not self.state.get('log_has_headers'): log_rows = build_log_headers(today) + log_rows
+        if log_rows: requests_body.append({'appendCells': {'sheetId': ids[SHEET_NAME_LOG], 'rows': self._raw_cells(log_rows), 'fields': 'userEnteredValue'}}) # เหมือน RAW
+        return requests_body, len(latest_rows), len(log_rows)
+
+    def write_run(self, blocks, today=None, log_readings=None):
+        blocks = [b for b in blocks if b and len(b) == 4]
+        logging.info(f"--- เริ่มต้นเขียนชีต '{SHEET_NAME_LATEST}' + '{SHEET_NAME_LOG}' แบบ batch ({len(blocks)} สถานี) ---")
+        if not self.service: logging.error("ไม่มี Service"); return False
+        if not blocks: logging.error("ไม่มีข้อมูลสำหรับเขียนชีต"); return False
+        for attempt in range(2):
+            try:
+                if not self.state: self.refresh_state()
+                requests_body, num_latest, num_log = self.build_requests(blocks, today=today, log_readings=log_readings)
+                with metrics.span('sheets_write', stations=len(blocks)): result = self.service.spreadsheets().batchUpdate(spreadsheetId=SPREADSHEET_ID, body={'requests': requests_body}).execute()
+                if num_log: self.state['log_has_headers'] = True; self._save_state()
+                logging.info(f"เขียน batch สำเร็จ! ชีตล่าสุด {num_latest} แถว, Log เพิ่ม {num_log} แถว ({len(result.get('replies', []))} requests ใน 1 API call)")
+                return True
+            except HttpError as error:
+                if attempt == 0 and self.state: logging.warning(f"HttpError ตอนเขียน batch ({error}), โหลดข้อมูลชีตใหม่แล้วลองอีกครั้ง..."); self.state = {}; continue
+                logging.error(f"เกิด HttpError ตอนเขียน batch: {error}"); return False
+            except Exception as e: logging.error(f"เกิดข้อผิดพลาดตอนเขียน batch: {e}"); import traceback; traceback.print_exc(); return False
+        return False
+
+
+# --- ฟังก์ชันรัน 1 รอบ: ดึงข้อมูลทุกสถานี แล้วเขียนชีตล่าสุด + Log ---
+def run_once(sheet_service, pool=None, writer=None, store=None, backfill=False, cache=None):
+    # เขียนชีตทันทีที่แต่ละ job เสร็จ (ชีตล่าสุดเขียนทับด้วยข้อมูลสะสมทุกสถานีที่ได้แล้ว)
+    # สถานีที่ข้อมูลไม่เปลี่ยน (hash เท่าเดิม / 304 / ยังอยู่ใน TTL) จะไม่ทำให้เกิดการเขียนชีต
+    own_store = store is None; store = store or ReadingStore(); writer = writer or SheetsWriter(sheet_service)
+    own_cache = cache is None; cache = cache or ResponseCache()
+    station_results = {}; logged_keys = None
+    fresh_ids = [rid for rid in TARGET_ROW_IDS if not backfill and cache.is_fresh(rid)]
+    for rid in fresh_ids: station_results[rid] = cache.cached_block(rid)
+    if fresh_ids: logging.info(f"ข้าม {len(fresh_ids)} สถานีที่ตรวจสอบไปแล้วภายใน {cache.ttl} วินาที: {fresh_ids}")
+    try:
+        for url, job_results in iter_station_results([rid for rid in TARGET_ROW_IDS if rid not in fresh_ids], pool=pool, cache=cache):
+            station_results.update(job_results)
+            job_ids = [rid for rid in job_results if job_results[rid]]
+            changed_ids = [rid for rid in job_ids if cache.update(rid, job_results[rid])]
+            try: # hash ใหม่ถูกบันทึกใน cache แล้ว: ถ้าบันทึก/เขียนไม่สำเร็จต้องล้าง ไม่เช่นนั้นรอบถัดไปจะเห็นว่า "ไม่เปลี่ยน" และข้ามไปตลอด
+                if job_ids and not changed_ids and not backfill and not store.unsynced(): logging.info(f"'{url}': ข้อมูล {len(job_ids)} สถานีไม่เปลี่ยนแปลง, ข้ามการเขียนชีต"); continue
+                if not job_ids: continue
+                if backfill and logged_keys is None: # อ่านชีต Log ครั้งเดียว เพื่อเติมเฉพาะวันที่ขาดหายไป
+                    try: logged_keys = writer.fetch_logged_keys()
+                    except Exception as e_log: logging.error(f"Backfill: อ่านชีต Log ไม่ได้ ({e_log}), ข้ามการเติมข้อมูลย้อนหลังเพื่อกันข้อมูลซ้ำ"); backfill = False
+                with metrics.span('store_record', stations=len(job_ids)): store.record_stations({rid: job_results[rid] for rid in (job_ids if backfill else changed_ids)}, backfill=backfill)
+                if backfill: logging.info(f"Backfill: ข้ามวันที่มีในชีต Log แล้ว {store.reconcile_logged(logged_keys)} รายการ")
+                pending = store.unsynced(); logging.info(f"มีข้อมูลที่ยังไม่ส่งเข้าชีต Log {len(pending)} รายการ")
+                formatted_blocks = [station_results[rid] for rid in TARGET_ROW_IDS if station_results.get(rid)] # สถานีที่ล้มเหลวไม่ทำให้ทั้งชุดหยุด
+                if writer.write_run(formatted_blocks, log_readings=pending): store.mark_synced(pending)
+                else: cache.invalidate(changed_ids) # เขียนไม่สำเร็จ: รอบถัดไปต้องเขียนใหม่แม้ข้อมูลเท่าเดิม
+            except BaseException: cache.invalidate(changed_ids); raise
+    finally:
+        if own_store: store.close()
+        if own_cache: cache.save()
+    failed_ids = [rid for rid in TARGET_ROW_IDS if not station_results.get(rid)]
+    if failed_ids: logging.warning(f"ไม่สามารถดึง/จัดรูปแบบข้อมูลจากแถว ID={failed_ids} ได้ ({len(failed_ids)}/{len(TARGET_ROW_IDS)} สถานี)")
+    return {rid: station_results.get(rid) for rid in TARGET_ROW_IDS}
+
+
+# --- ฟังก์ชันดึงข้อมูลทุกสถานีโดยไม่เขียน Google Sheets / ฐานข้อมูล (ใช้กับ --dry-run และเรียกจากโค้ดอื่น) ---
+def scrape_all(row_ids=None, pool=None):
+    station_results = {}
+    for url, job_results in iter_station_results(TARGET_ROW_IDS if row_ids is None else [str(r) for r in row_ids], pool=pool): station_results.update(job_results)
+    return station_results
+
+
+# --- แปลงผลลัพธ์เป็น dict สำหรับ --output json: ข้อมูล 4 แถวเหมือนชีต + ค่าตัวเลขของวันล่าสุด ---
+def results_to_json(station_results):
+    stations = {}
+    for rid, block in station_results.items():
+        if not block: stations[rid] = None; continue
+        latest = ReadingStore.station_readings(rid, block)[0]
+        stations[rid] = {'rows': block, 'latest': {k: latest[k] for k in ('date', 'name', 'water_level', 'discharge', 'percent_capacity', 'trend')}}
+    return {'generated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'stations': stations, 'failed': [rid for rid, block in station_results.items() if not block]}
+
+
+# --- โหมด --watch: รันวนทุก interval วินาที โดยใช้ DriverPool ที่เปิดค้างไว้ ---
+def run_watch(sheet_service, interval=None, pool_size=None, max_uses=None, metrics_prom=None):
+    # Chrome ใน pool ใช้ได้พร้อมกันสูงสุดเท่าจำนวนหน้า (URL) ที่ต้องดึง จึงไม่เปิดเกินจำนวนนั้น
+    pool_size = min(pool_size or DRIVER_POOL_SIZE, max(1, len(group_station_jobs())))
+    interval = interval or WATCH_INTERVAL_SECONDS; pool = DriverPool(size=pool_size, max_uses=max_uses); writer = SheetsWriter(sheet_service); store = ReadingStore(); cache = ResponseCache()
+    if FETCH_MODE == 'selenium': pool.warm() # โหมด auto/http เปิด Chrome เมื่อจำเป็นต้องใช้ Selenium สำรองเท่านั้น
+    logging.info(f"--- เริ่มโหมด Watch: ทุก {interval} วินาที (pool={pool.size}, max_uses={pool.max_uses}) ---")
+    try:
+        while True:
+            cycle_start = time.time()
+            try: run_once(sheet_service, pool=pool, writer=writer, store=store, cache=cache)
+            except Exception as e_cycle: logging.error(f"รอบนี้ผิดพลาด: {e_cycle}")
+            cache.save()
+            if metrics_prom: metrics.write_prometheus(metrics_prom) # อัปเดต textfile ทุกรอบ (โหมดนี้ไม่จบจนกว่าจะ Ctrl+C)
+            elapsed = time.time() - cycle_start; logging.info(f"รอบนี้ใช้เวลา {elapsed:.2f} วินาที, รอบถัดไปในอีก {max(0, interval - elapsed):.0f} วินาที")
+            time.sleep(max(0, interval - elapsed))
+    except KeyboardInterrupt: logging.info("หยุดโหมด Watch")
+    finally: pool.close(); store.close(); cache.save()
+
+
+# --- CLI: python selenium_table_scraper.py [--dry-run] [--output json] [--watch] [--backfill] ---
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="ดึงข้อมูลระดับน้ำ/ปริมาณน้ำจาก RID hydro4d แล้วเขียนลง Google Sheets")
+    parser.add_argument('--config', help=f"ไฟล์ config (ค่าเริ่มต้น {CONFIG_FILE} ข้างสคริปต์)")
+    mode = parser.add_mutually_exclusive_group() # --dry-run รันรอบเดียวเสมอ
+    mode.add_argument('--dry-run', action='store_true', help="ดึงข้อมูลอย่างเดียว ไม่เชื่อมต่อ Google และไม่บันทึกฐานข้อมูล")
+    mode.add_argument('--watch', action='store_true', help="รันวนต่อเนื่องโดยใช้ Chrome ที่เปิดค้างไว้")
+    parser.add_argument('--output', choices=['log', 'json'], default='log', help="json = พิมพ์ผลลัพธ์เป็น JSON ทาง stdout")
+    parser.add_argument('--interval', type=int, help="ระยะห่างแต่ละรอบ (วินาที) ในโหมด --watch (ค่าเริ่มต้น WATCH_INTERVAL_SECONDS)")
+    parser.add_argument('--pool-size', type=int, help="จำนวน Chrome ที่เปิดค้างไว้ใน pool = จำนวนหน้า (URL) ที่ดึงพร้อมกัน ไม่เกินจำนวนหน้าใน TARGET_ROW_IDS (ค่าเริ่มต้น DRIVER_POOL_SIZE)")
+    parser.add_argument('--backfill', action='store_true', help="เติมข้อมูล 7 วันย้อนหลัง (Q7..Q1) ที่ยังไม่มีในชีต Log")
+    parser.add_argument('--max-uses', type=int, help="ปิด/เปิด Chrome ใหม่หลังใช้ครบกี่รอบ (ค่าเริ่มต้น DRIVER_MAX_USES)")
+    parser.add_argument('--metrics-jsonl', help="เขียนเวลาแต่ละขั้นตอนเป็น JSON lines ลงไฟล์นี้ (ค่าเริ่มต้น METRICS_JSONL)")
+    parser.add_argument('--metrics-prom', help="เขียนสรุปเวลาแต่ละขั้นตอนเป็น Prometheus text file (ค่าเริ่มต้น METRICS_PROM)")
+    args = parser.parse_args(argv)
+    setup_logging()
+    try: load_config(args.config, require_sheets=not args.dry_run)
+    except Exception as e: logging.error(f"Error อ่าน config: {e}"); return 1
+    metrics.jsonl_path = args.metrics_jsonl or METRICS_JSONL; metrics_prom = args.metrics_prom or METRICS_PROM
+    start_time = time.time(); exit_code = 0; station_results = None
+    logging.info(f"--- Script Start: Scrape & Log (FETCH_MODE={FETCH_MODE}, {len(TARGET_ROW_IDS)} สถานี: {', '.join(TARGET_ROW_IDS)}{', dry-run' if args.dry_run else ''}) ---") # อัปเดตชื่อ Log
+    if args.dry_run:
+        with metrics.span('run'): station_results = scrape_all()
+    else:
+        with metrics.span('auth'): sheet_service = authenticate_google_sheets()
+        if sheet_service:
+            if args.watch: run_watch(sheet_service, interval=args.interval, pool_size=args.pool_size, max_uses=args.max_uses, metrics_prom=metrics_prom)
+            else:
+                with metrics.span('run'): station_results = run_once(sheet_service, backfill=args.backfill)
+        else: logging.error("ไม่สามารถเชื่อมต่อ Google Sheets API ได้"); exit_code = 1
+    if station_results is not None:
+        if not any(station_results.values()): exit_code = 1
+        if args.output == 'json': json.dump(results_to_json(station_results), sys.stdout, ensure_ascii=False, indent=2); sys.stdout.write('\n')
     end_time = time.time()
+    metrics.log_summary()
+    if metrics_prom: metrics.write_prometheus(metrics_prom)
     logging.info(f"--- Script End: Total Time: {end_time - start_time:.2f} seconds ---")
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
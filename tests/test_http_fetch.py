@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+import selenium_table_scraper as scraper
+
+PAGE_URL = 'https://example.test/hydro4d.html'
+DATA_URL = 'https://example.test/data/grid.json'
+PAGE_HTML = '<html><script>$("#jqGrid").jqGrid({ url: "data/grid.json", datatype: "json" });</script></html>'
+
+
+def station_cells(n):
+    cells = [str(n), f"สถานี {n}", "ลุ่มน้ำ", "อำเภอ", "จังหวัด", "10.50 200"]
+    cells += [f"{d}.10 {100 + d}.5" for d in range(1, 8)]
+    return cells + ["3.25 150.0", "กราฟ", "41", "คงที่"]
+
+
+@pytest.fixture(autouse=True)
+def default_config():
+    scraper.apply_config({})
+    yield
+    scraper.apply_config({})
+
+
+def test_parse_grid_rows_json_cells():
+    payload = json.dumps({'rows': [{'id': '235', 'cell': station_cells(1)}, {'id': 236, 'cell': station_cells(2)}]})
+    rows = scraper.parse_grid_rows(payload)
+    assert sorted(rows) == ['235', '236']
+    assert rows['235'] == station_cells(1)
+    assert scraper.format_raw_cols(rows['236']) is not None
+
+
+def test_parse_grid_rows_xml_strips_cell_html():
+    cells = station_cells(1); cells[1] = '<b>สถานี</b> 1'
+    xml = '<rows>' + '<row id="235">' + ''.join(f'<cell><![CDATA[{c}]]></cell>' for c in cells) + '</row></rows>'
+    rows = scraper.parse_grid_rows(xml)
+    assert rows['235'][1] == 'สถานี 1'
+    assert len(rows['235']) == 17 and scraper.format_raw_cols(rows['235']) is not None
+
+
+def test_parse_grid_rows_array_rows_use_first_item_as_id():
+    rows = scraper.parse_grid_rows(json.dumps([['235'] + station_cells(1), ['236'] + station_cells(2)]))
+    assert sorted(rows) == ['235', '236']
+    assert rows['235'] == station_cells(1)
+    assert scraper.format_raw_cols(rows['235']) is not None
+
+
+def test_fetch_stations_http_discovers_grid_url():
+    transport = scraper.RecordedTransport({PAGE_URL: PAGE_HTML, DATA_URL: json.dumps({'rows': [{'id': '235', 'cell': station_cells(1)}]})})
+    results = scraper.fetch_stations_http(['235', '999'], transport=transport, url=PAGE_URL)
+    assert [call[0] for call in transport.calls] == [PAGE_URL, DATA_URL]
+    assert results['999'] is None
+    block = results['235']
+    assert len(block) == 4 and block[:2] == scraper.build_web_headers()
+    assert block[2][12] == '7.10' and block[3][12] == '107.5'
+
+
+def test_fetch_stations_http_returns_none_when_page_fails():
+    transport = scraper.RecordedTransport({PAGE_URL: (503, {}, '')})
+    assert scraper.fetch_stations_http(['235'], transport=transport, url=PAGE_URL) is None
+    assert scraper.fetch_stations_http(['235'], transport=scraper.RecordedTransport({PAGE_URL: '<html></html>'}), url=PAGE_URL) is None
+
+
+def test_fetch_stations_http_uses_cache_on_304(tmp_path):
+    cache = scraper.ResponseCache(str(tmp_path / 'response_cache.json'), ttl=0)
+    payload = json.dumps({'rows': [{'id': '235', 'cell': station_cells(1)}]})
+    first = scraper.fetch_stations_http(['235'], transport=scraper.RecordedTransport({PAGE_URL: PAGE_HTML, DATA_URL: (200, {'ETag': '"v1"'}, payload)}), url=PAGE_URL, cache=cache)
+    cache.update('235', first['235'])
+    transport = scraper.RecordedTransport({DATA_URL: (304, {}, '')})
+    results = scraper.fetch_stations_http(['235'], transport=transport, url=PAGE_URL, cache=cache)
+    assert transport.calls == [(DATA_URL, {'rows': 10000, 'page': 1}, {'If-None-Match': '"v1"'})]
+    assert results['235'] == first['235']
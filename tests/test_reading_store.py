@@ -0,0 +1,118 @@
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+import benchmark_scraper
+import selenium_table_scraper as scraper
+
+
+def station_block(n, level='7.10'):
+    cells = [str(n), f"สถานี {n}", "ลุ่มน้ำ", "อำเภอ", "จังหวัด", "10.50 200"] + [f"{d}.10 {100 + d}.5" for d in range(1, 7)] + [f"{level} 12345.67"]
+    return scraper.build_web_headers() + scraper.format_raw_cols(cells + ["3.25 150.0", "กราฟ", "41", "คงที่"])
+
+
+@pytest.fixture(autouse=True)
+def sheets_config():
+    scraper.apply_config({'SPREADSHEET_ID': 'test', 'SHEET_NAME_LATEST': 'ExtractedData', 'SHEET_NAME_LOG': 'Log', 'TARGET_ROW_IDS': '235,236'})
+    yield
+    scraper.apply_config({})
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = scraper.ReadingStore(str(tmp_path / 'readings.sqlite3'))
+    yield store
+    store.close()
+
+
+def run(monkeypatch, tmp_path, store, blocks, service=None, backfill=False):
+    # รัน run_once 1 รอบ โดยแทนการดึงข้อมูลจากเว็บด้วย blocks ที่เตรียมไว้
+    monkeypatch.setattr(scraper, 'iter_station_results', lambda row_ids, pool=None, cache=None: iter([('https://example.test/', {rid: blocks.get(rid) for rid in row_ids})]))
+    service = service or benchmark_scraper.FakeSheetsService()
+    writer = scraper.SheetsWriter(service, state_path=str(tmp_path / 'sheets_state.json')); cache = scraper.ResponseCache(str(tmp_path / 'response_cache.json'), ttl=0)
+    try: scraper.run_once(service, writer=writer, store=store, backfill=backfill, cache=cache)
+    finally: cache.save()
+    return service
+
+
+def test_same_day_rerun_adds_no_log_rows(monkeypatch, tmp_path, store):
+    blocks = {'235': station_block(1), '236': station_block(2)}
+    first = run(monkeypatch, tmp_path, store, blocks)
+    assert first.log_rows == 2 + 4 and store.unsynced() == []
+    second = run(monkeypatch, tmp_path, store, blocks)
+    assert second.calls == [] and second.log_rows == 0 # ข้อมูลไม่เปลี่ยน: ไม่เขียนชีตเลย
+    (tmp_path / 'response_cache.json').unlink() # cache หาย: ดึง/เขียนชีตล่าสุดใหม่ แต่ Log ไม่ซ้ำ
+    third = run(monkeypatch, tmp_path, store, blocks)
+    assert third.calls == ['batchUpdate'] and third.log_rows == 0
+    assert len(store.history('235')) == 1
+
+
+def test_upsert_updates_values_and_keeps_synced(store):
+    today = datetime.now()
+    store.record_station('235', station_block(1), today=today)
+    store.mark_synced(store.unsynced())
+    store.record_station('235', station_block(1, level='8.25'), today=today)
+    [reading] = store.history('235')
+    assert reading['water_level'] == 8.25 and reading['water_level_text'] == '8.25' and reading['synced'] == 1
+    assert store.unsynced() == []
+
+
+def test_log_rows_keep_scraped_text(store):
+    store.record_station('235', station_block(1))
+    top, bottom = scraper.build_log_rows_from_reading(store.unsynced()[0])
+    assert top[6] == '7.10' and bottom[6] == '12345.67'
+    assert scraper.format_reading_value(123456789.0) == '123456789' and scraper.format_reading_value(12345.67) == '12345.67'
+
+
+def test_opening_old_database_adds_text_columns(tmp_path):
+    path = str(tmp_path / 'old.sqlite3'); conn = sqlite3.connect(path)
+    conn.executescript(scraper.ReadingStore.SCHEMA.replace(' water_level_text TEXT, discharge_text TEXT,', ''))
+    conn.execute("INSERT INTO readings (station, date, water_level, discharge, name, scraped_at) VALUES ('235', '2026-10-01', 123456789, 0.5, 'สถานี 1', 't')")
+    conn.commit(); conn.close()
+    store = scraper.ReadingStore(path)
+    try:
+        [reading] = store.unsynced()
+        assert reading['water_level_text'] is None
+        top, bottom = scraper.build_log_rows_from_reading(reading)
+        assert top[6] == '123456789' and bottom[6] == '0.5'
+    finally: store.close()
+
+
+class LoggedSheetsService(benchmark_scraper.FakeSheetsService):
+    # ชีต Log ที่มีข้อมูลบางวันอยู่แล้ว (คอลัมน์ B = ชื่อสถานี, H = วันที่ dd/mm/yyyy)
+    def __init__(self, logged):
+        super().__init__(); self.logged = logged
+    def get(self, spreadsheetId=None, range=None, **kwargs):
+        if range: return self._request('values.get', {'values': [['1', name, '', '', '', '', '', date.strftime('%d/%m/%Y')] for name, date in self.logged]})
+        return super().get(spreadsheetId=spreadsheetId, **kwargs)
+
+
+def test_backfill_skips_days_already_in_log(monkeypatch, tmp_path, store):
+    dates = scraper.q_column_dates()
+    service = run(monkeypatch, tmp_path, store, {'235': station_block(1), '236': None}, service=LoggedSheetsService([("สถานี 1", dates[0]), ("สถานี 1", dates[3])]), backfill=True)
+    assert service.calls[:2] == ['values.get', 'get'] # อ่านชีต Log ครั้งเดียวก่อนเขียน
+    assert service.log_rows == 2 + 2 * 5 # 7 วัน - 2 วันที่มีในชีตแล้ว
+    assert len(store.history('235')) == 7 and store.unsynced() == []
+    rerun = run(monkeypatch, tmp_path, store, {'235': station_block(1), '236': None}, service=LoggedSheetsService([]), backfill=True)
+    assert rerun.log_rows == 0
+
+
+def test_backfilled_days_have_no_capacity_or_trend(store):
+    store.record_station('235', station_block(1), backfill=True)
+    readings = store.history('235')
+    assert [(r['percent_capacity'], r['trend']) for r in readings] == [(None, None)] * 6 + [('41', 'คงที่')]
+    for reading in readings[:-1]:
+        top, _ = scraper.build_log_rows_from_reading(reading)
+        assert top[8:10] == ['', '']
+
+
+def test_failed_store_write_is_retried_next_run(monkeypatch, tmp_path, store):
+    blocks = {'235': station_block(1), '236': station_block(2)}
+    def locked(*args, **kwargs): raise sqlite3.OperationalError('database is locked')
+    with monkeypatch.context() as patch:
+        patch.setattr(store, 'record_stations', locked)
+        with pytest.raises(sqlite3.OperationalError): run(monkeypatch, tmp_path, store, blocks)
+    service = run(monkeypatch, tmp_path, store, blocks) # hash ของรอบที่ล้มเหลวต้องไม่ถูกเก็บไว้
+    assert service.calls == ['get', 'batchUpdate'] and service.log_rows == 2 + 4
+    assert len(store.history('235')) == 1 and store.unsynced() == []
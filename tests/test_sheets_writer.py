@@ -0,0 +1,74 @@
+from datetime import datetime
+
+import pytest
+
+import benchmark_scraper
+import selenium_table_scraper as scraper
+
+TODAY = datetime(2026, 10, 18)
+
+
+class FakeHttpError(Exception):
+    pass
+
+
+class FlakySheetsService(benchmark_scraper.FakeSheetsService):
+    # batchUpdate ครั้งแรกล้มเหลว (เช่น sheetId ใน state เก่าไม่ตรงแล้ว)
+    def batchUpdate(self, spreadsheetId=None, body=None):
+        if 'batchUpdate' not in self.calls: self.calls.append('batchUpdate'); raise FakeHttpError('Invalid sheetId')
+        return super().batchUpdate(spreadsheetId=spreadsheetId, body=body)
+
+    @staticmethod
+    def always_fail(spreadsheetId=None, body=None): raise FakeHttpError('Quota exceeded')
+
+
+def station_block(n):
+    cells = [str(n), f"สถานี {n}", "ลุ่มน้ำ", "อำเภอ", "จังหวัด", "10.50 200"] + [f"{d}.10 {100 + d}.5" for d in range(1, 8)] + ["3.25 150.0", "กราฟ", "41", "คงที่"]
+    return scraper.build_web_headers(TODAY) + scraper.format_raw_cols(cells)
+
+
+@pytest.fixture(autouse=True)
+def sheets_config(monkeypatch):
+    scraper.apply_config({'SPREADSHEET_ID': 'test', 'SHEET_NAME_LATEST': 'ExtractedData', 'SHEET_NAME_LOG': 'Log'})
+    monkeypatch.setattr(scraper, 'HttpError', FakeHttpError)
+    yield
+    scraper.apply_config({})
+
+
+def cached_state(log_has_headers):
+    return {'spreadsheet_id': 'test', 'sheet_ids': {'ExtractedData': 0, 'Log': 1}, 'log_has_headers': log_has_headers}
+
+
+@pytest.mark.parametrize('log_has_headers, expected_log_rows', [(False, 2 + 4), (True, 4)])
+def test_build_requests_adds_log_headers_only_once(tmp_path, log_has_headers, expected_log_rows):
+    writer = scraper.SheetsWriter(benchmark_scraper.FakeSheetsService(), state_path=str(tmp_path / 'state.json')); writer.state = cached_state(log_has_headers)
+    requests_body, num_latest, num_log = writer.build_requests([station_block(1), station_block(2)], today=TODAY)
+    assert [next(iter(r)) for r in requests_body] == ['updateCells', 'pasteData', 'appendCells']
+    assert num_latest == 2 + 4 and num_log == expected_log_rows
+    log_rows = requests_body[2]['appendCells']['rows']
+    assert len(log_rows) == expected_log_rows
+    assert (log_rows[0]['values'][0]['userEnteredValue']['stringValue'] == 'ลำดับ') == (not log_has_headers)
+
+
+def test_write_run_sends_one_batch_and_caches_state(tmp_path):
+    service = benchmark_scraper.FakeSheetsService(); state_path = str(tmp_path / 'state.json')
+    assert scraper.SheetsWriter(service, state_path=state_path).write_run([station_block(1), None, station_block(2)], today=TODAY)
+    assert service.calls == ['get', 'batchUpdate'] and service.log_rows == 2 + 4
+    service.calls.clear(); service.log_rows = 0
+    assert scraper.SheetsWriter(service, state_path=state_path).write_run([station_block(1)], today=TODAY) # state จากไฟล์: ไม่ต้อง get และไม่เขียน Header ซ้ำ
+    assert service.calls == ['batchUpdate'] and service.log_rows == 2
+
+
+def test_write_run_refreshes_state_and_retries_once_on_http_error(tmp_path):
+    service = FlakySheetsService(); writer = scraper.SheetsWriter(service, state_path=str(tmp_path / 'state.json')); writer.state = cached_state(True)
+    assert writer.write_run([station_block(1)], today=TODAY)
+    assert service.calls == ['batchUpdate', 'get', 'batchUpdate']
+    assert writer.state['log_has_headers'] and service.log_rows == 2 + 2 # state ใหม่จาก get: Log ยังว่าง จึงเขียน Header
+
+
+def test_write_run_gives_up_after_second_http_error(tmp_path):
+    service = FlakySheetsService()
+    service.batchUpdate = FlakySheetsService.always_fail
+    writer = scraper.SheetsWriter(service, state_path=str(tmp_path / 'state.json')); writer.state = cached_state(True)
+    assert writer.write_run([station_block(1)], today=TODAY) is False
+    assert service.calls.count('get') == 1